@@ -0,0 +1,97 @@
+"""Latency of the movies API at increasing page depths
+
+    python -m benchmarks.api_latency
+    python -m benchmarks.api_latency --url http://127.0.0.1:8000/api/v1/movies/ --depths 1 100 1000 10000
+
+The cursor chain is walked from the first page to the deepest requested
+depth, then every requested page is fetched --requests times from
+--concurrency threads. With keyset pagination p50/p99 should stay flat
+as the depth grows.
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+URL = "http://127.0.0.1:8000/api/v1/movies/"
+DEPTHS = (1, 10, 100, 1000)
+
+
+def fetch(url: str) -> tuple[float, dict]:
+    start = time.perf_counter()
+    with urlopen(url) as response:
+        data = json.load(response)
+    return time.perf_counter() - start, data
+
+
+def find_pages(url: str, depths: list[int]) -> dict[int, str]:
+    """URLs of the pages at the given depths, the first page is at depth 1"""
+    pages = {}
+    depth = 1
+    while url and depth <= max(depths):
+        if depth in depths:
+            pages[depth] = url
+        _, data = fetch(url)
+        url = data["next"]
+        depth += 1
+    missing = sorted(set(depths) - pages.keys())
+    if missing:
+        print(f"the catalogue ends at page {depth - 1}, skipped depths {missing}")
+    return pages
+
+
+def measure(url: str, requests: int, concurrency: int) -> dict:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [seconds for seconds, _ in executor.map(fetch, [url] * requests)]
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{'depth':>8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for depth, result in report["depths"].items():
+        print(
+            f"{depth:>8} {result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f} "
+            f"{result['max_ms']:>10.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--depths", type=int, nargs="+", default=DEPTHS)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="requests per depth")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--output",
+        default=f"benchmark-api-{datetime.now():%Y%m%d-%H%M%S}.json",
+        help="where to write the JSON report",
+    )
+    args = parser.parse_args()
+
+    first_page = f"{args.url}?{urlencode({'page_size': args.page_size})}"
+    pages = find_pages(first_page, args.depths)
+    report = {
+        "params": vars(args),
+        "depths": {
+            depth: measure(url, args.requests, args.concurrency)
+            for depth, url in sorted(pages.items())
+        },
+    }
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
+
+from movies.admin import CachedAutocompleteJsonView
 
 urlpatterns = [
+    # takes the place of the admin autocomplete view, which has the same path
+    path(
+        'admin/autocomplete/',
+        admin.site.admin_view(CachedAutocompleteJsonView.as_view(admin_site=admin.site)),
+    ),
     path('admin/', admin.site.urls),
+    path('api/', include('movies.api.urls')),
 ]
@@ -0,0 +1,210 @@
+"""Admin actions which change the selection with set-based statements
+
+The selected ids are read in chunks of BULK_CHUNK_SIZE ordered by id, and
+every chunk is changed by a few statements in its own transaction, so a
+huge selection never holds its locks for long. Model signals are not
+sent, the documents of the changed film works are refreshed instead.
+Deletions are logged in bulk, like the delete action of the admin
+logs every object.
+"""
+import uuid
+from functools import partial
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from movies import cache
+from movies.choices import FilmWorkType
+from movies.documents import schedule_refresh
+from movies.models import FilmWork, FilmWorkDocument, Genre, GenreFilmwork, Person, PersonFilmwork
+from movies.paginator import estimate_count
+
+BULK_CHUNK_SIZE = 1000
+ASSIGN_GENRE_SQL = """
+    INSERT INTO {table} (id, film_work_id, genre_id, created)
+    SELECT id, film_work_id, %s, now()
+    FROM unnest(%s::uuid[], %s::uuid[]) AS link (id, film_work_id)
+    ON CONFLICT (genre_id, film_work_id) DO NOTHING
+"""
+DELETE_LINKS_SQL = "DELETE FROM {table} WHERE {column} = ANY(%s::uuid[]) RETURNING film_work_id"
+DELETE_SQL = "DELETE FROM {table} WHERE id = ANY(%s::uuid[])"
+# rows referencing the deleted objects, removed before them
+CASCADES = {
+    FilmWork: (
+        (GenreFilmwork, "film_work_id", _("Genre links")),
+        (PersonFilmwork, "film_work_id", _("Person links")),
+        (FilmWorkDocument, "film_work_id", _("Documents")),
+    ),
+    Genre: ((GenreFilmwork, "genre_id", _("Genre links")),),
+    Person: ((PersonFilmwork, "person_id", _("Person links")),),
+}
+
+
+class AssignGenreForm(forms.Form):
+    genre = forms.ModelChoiceField(Genre.objects.order_by("name"), label=_("Genre"))
+
+
+class ChangeTypeForm(forms.Form):
+    type = forms.ChoiceField(choices=FilmWorkType.choices, label=_("Type"))
+
+
+@admin.action(description=_("Assign a genre to selected film works"), permissions=["change"])
+def assign_genre(modeladmin, request, queryset):
+    form = AssignGenreForm(request.POST if "post" in request.POST else None)
+    if not form.is_valid():
+        links = GenreFilmwork.objects.filter(film_work__in=queryset.values("pk"))
+        return confirmation(
+            modeladmin,
+            request,
+            queryset,
+            form,
+            {
+                FilmWork._meta.verbose_name_plural: estimate_count(queryset),
+                _("Existing genre links"): estimate_count(links),
+            },
+        )
+
+    genre_id = str(form.cleaned_data["genre"].pk)
+    added = run_in_chunks(queryset, partial(_assign_genre, genre_id))
+    modeladmin.message_user(
+        request, _("%(count)d genre links added.") % {"count": added}, messages.SUCCESS
+    )
+
+
+@admin.action(description=_("Change type of selected film works"), permissions=["change"])
+def change_type(modeladmin, request, queryset):
+    form = ChangeTypeForm(request.POST if "post" in request.POST else None)
+    if not form.is_valid():
+        return confirmation(
+            modeladmin,
+            request,
+            queryset,
+            form,
+            {FilmWork._meta.verbose_name_plural: estimate_count(queryset)},
+        )
+
+    changed = run_in_chunks(queryset, partial(_change_type, form.cleaned_data["type"]))
+    modeladmin.message_user(
+        request, _("%(count)d film works changed.") % {"count": changed}, messages.SUCCESS
+    )
+
+
+@admin.action(description=_("Delete selected objects with their links"), permissions=["delete"])
+def delete_set_wise(modeladmin, request, queryset):
+    model = queryset.model
+    if "post" not in request.POST:
+        estimates = {model._meta.verbose_name_plural: estimate_count(queryset)}
+        for link_model, column, label in CASCADES[model]:
+            links = link_model.objects.filter(**{f"{column}__in": queryset.values("pk")})
+            estimates[label] = estimate_count(links)
+        return confirmation(modeladmin, request, queryset, None, estimates)
+
+    deleted = run_in_chunks(queryset, partial(_delete, model, request.user.pk))
+    namespace = f"{cache.AUTOCOMPLETE}.{model._meta.model_name}"
+    transaction.on_commit(partial(cache.invalidate, namespace), using=queryset.db)
+    modeladmin.message_user(
+        request,
+        _("%(count)d %(objects)s deleted.")
+        % {"count": deleted, "objects": model._meta.verbose_name_plural},
+        messages.SUCCESS,
+    )
+
+
+def confirmation(modeladmin, request, queryset, form, estimates) -> TemplateResponse:
+    """Page which shows how many rows the action touches and asks to go on"""
+    opts = modeladmin.model._meta
+    action = request.POST["action"]
+    context = {
+        **modeladmin.admin_site.each_context(request),
+        "title": modeladmin.get_actions(request)[action][2],
+        "opts": opts,
+        "action": action,
+        "form": form,
+        "estimates": estimates,
+        "select_across": request.POST.get("select_across", "0"),
+        "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+        "media": modeladmin.media,
+    }
+    request.current_app = modeladmin.admin_site.name
+    return TemplateResponse(request, "admin/movies/bulk_action_confirmation.html", context)
+
+
+def run_in_chunks(queryset, operation) -> int:
+    """Apply operation(ids, using) to the selected ids chunk by chunk, every
+    chunk in its own transaction. Returns the total of affected rows.
+    """
+    using = queryset.db
+    ids = queryset.order_by("pk").values_list("pk", flat=True)
+    affected, last_id = 0, None
+    while True:
+        batch = ids if last_id is None else ids.filter(pk__gt=last_id)
+        chunk = [str(pk) for pk in batch[:BULK_CHUNK_SIZE]]
+        if not chunk:
+            return affected
+        with transaction.atomic(using=using):
+            affected += operation(chunk, using)
+        last_id = chunk[-1]
+
+
+def _assign_genre(genre_id: str, film_work_ids: list[str], using: str) -> int:
+    with connections[using].cursor() as cursor:
+        link_ids = [str(uuid.uuid4()) for _pk in film_work_ids]
+        cursor.execute(
+            ASSIGN_GENRE_SQL.format(table=_table(GenreFilmwork)),
+            [genre_id, link_ids, film_work_ids],
+        )
+        added = cursor.rowcount
+    schedule_refresh(film_work_ids, using)
+    return added
+
+
+def _change_type(film_work_type: str, film_work_ids: list[str], using: str) -> int:
+    changed = (
+        FilmWork.objects.using(using)
+        .filter(pk__in=film_work_ids)
+        .update(type=film_work_type, modified=timezone.now())
+    )
+    schedule_refresh(film_work_ids, using)
+    return changed
+
+
+def _delete(model, user_id, ids: list[str], using: str) -> int:
+    _log_deletions(model, user_id, ids, using)
+    film_work_ids = set(ids) if model is FilmWork else set()
+    with connections[using].cursor() as cursor:
+        for link_model, column, _label in CASCADES[model]:
+            cursor.execute(DELETE_LINKS_SQL.format(table=_table(link_model), column=column), [ids])
+            film_work_ids.update(str(row[0]) for row in cursor.fetchall())
+        cursor.execute(DELETE_SQL.format(table=_table(model)), [ids])
+        deleted = cursor.rowcount
+    schedule_refresh(film_work_ids, using)
+    return deleted
+
+
+def _log_deletions(model, user_id, ids: list[str], using: str) -> None:
+    """The LogEntry which ModelAdmin.log_deletion writes, for every object of the chunk"""
+    content_type = ContentType.objects.db_manager(using).get_for_model(
+        model, for_concrete_model=False
+    )
+    LogEntry.objects.using(using).bulk_create(
+        LogEntry(
+            user_id=user_id,
+            content_type=content_type,
+            object_id=str(obj.pk),
+            object_repr=str(obj)[:200],
+            action_flag=DELETION,
+        )
+        for obj in model.objects.using(using).filter(pk__in=ids)
+    )
+
+
+def _table(model) -> str:
+    return f'"{model._meta.db_table}"'
@@ -1,36 +1,185 @@
+import hashlib
+import uuid
+
 from django.contrib import admin
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+from django.http import HttpResponse
+from django.utils.text import smart_split, unescape_string_literal
+
+from . import cache
+from .actions import assign_genre, change_type, delete_set_wise
 from .models import Genre, FilmWork, GenreFilmwork, Person, PersonFilmwork
+from .paginator import EstimatedCountPaginator
+from .widgets import LoadedAutocompleteSelect
+
+EXACT_COUNT_VAR = "exact_count"
+
+
+class IndexedSearchMixin:
+    """Admin search served by the trigram indexes of the search fields.
+
+    A term which is a UUID is looked up by primary key. Other terms are
+    matched with icontains on the text fields only, as casting the id to
+    text in the same OR would make Postgres scan the whole table.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        try:
+            pk = uuid.UUID(search_term)
+        except ValueError:
+            pass
+        else:
+            return queryset.filter(pk=pk), False
+
+        search_fields = self.get_search_fields(request)
+        query = Q()
+        for bit in smart_split(search_term):
+            if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+                bit = unescape_string_literal(bit)
+            bit_query = Q()
+            for field in search_fields:
+                bit_query |= Q(**{f"{field}__icontains": bit})
+            query &= bit_query
+        return queryset.filter(query), False
+
+
+class EstimatedCountMixin:
+    """Changelists paginated without a full count of large tables.
+
+    The count of the current list is exact when the page is opened with
+    ?exact_count=1, which the pagination template links to.
+    """
+
+    paginator = EstimatedCountPaginator
+    # the count of the whole table next to a filtered count
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        request.exact_count = EXACT_COUNT_VAR in request.GET
+        if request.exact_count:
+            # the changelist treats unknown parameters as lookups
+            request.GET = request.GET.copy()
+            del request.GET[EXACT_COUNT_VAR]
+        return super().changelist_view(request, extra_context)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        paginator = self.paginator(
+            queryset,
+            per_page,
+            orphans,
+            allow_empty_first_page,
+            exact=getattr(request, "exact_count", False),
+        )
+        query = request.GET.copy()
+        query[EXACT_COUNT_VAR] = "1"
+        paginator.exact_count_url = f"?{query.urlencode()}"
+        return paginator
+
+
+class SetWiseDeleteMixin:
+    """Replaces the default delete action, which loads every selected
+    object with its related objects and deletes them one by one
+    """
+
+    actions = (delete_set_wise,)
+
+    def get_actions(self, request):
+        model_actions = super().get_actions(request)
+        model_actions.pop("delete_selected", None)
+        return model_actions
+
+
+class CachedAutocompleteJsonView(AutocompleteJsonView):
+    """Admin autocomplete which caches the results of every search until
+    the searched model changes
+    """
+
+    def get(self, request, *args, **kwargs):
+        _, self.model_admin, _, _ = self.process_request(request)
+        if not self.has_perm(request):
+            raise PermissionDenied
+
+        namespace = f"{cache.AUTOCOMPLETE}.{self.model_admin.model._meta.model_name}"
+        key = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+        content = cache.lookup(namespace, key)
+        if content is not None:
+            return HttpResponse(content, content_type="application/json")
+
+        response = super().get(request, *args, **kwargs)
+        cache.store(namespace, key, response.content)
+        return response
+
+
+class LoadedRelatedInlineFormSet(BaseInlineFormSet):
+    """Hands the related objects of the saved rows to their autocomplete widgets"""
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        if form.instance._state.adding:
+            return form
+        for name, field in form.fields.items():
+            widget = getattr(field.widget, "widget", field.widget)
+            if isinstance(widget, LoadedAutocompleteSelect):
+                widget.selected = getattr(form.instance, name)
+        return form
+
+
+class LoadedRelatedInlineMixin:
+    """Inline which loads the autocomplete relations of its rows in the
+    query of the rows, so a change view runs the same number of queries
+    however many links the object has
+    """
+
+    formset = LoadedRelatedInlineFormSet
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.get_autocomplete_fields(request))
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs["widget"] = LoadedAutocompleteSelect(
+                db_field, self.admin_site, using=kwargs.get("using")
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
-class GenreFilmworkInline(admin.TabularInline):
+class GenreFilmworkInline(LoadedRelatedInlineMixin, admin.TabularInline):
     model = GenreFilmwork
     autocomplete_fields = ('genre',) 
 
 
-class PersonFilmworkInline(admin.TabularInline):
+class PersonFilmworkInline(LoadedRelatedInlineMixin, admin.TabularInline):
     model = PersonFilmwork
     autocomplete_fields = ('film_work',)
 
 
 @admin.register(Person)
-class PersonAdmin(admin.ModelAdmin):
+class PersonAdmin(SetWiseDeleteMixin, EstimatedCountMixin, IndexedSearchMixin, admin.ModelAdmin):
     inlines = (PersonFilmworkInline,)
 
     list_display = ("full_name", "created", "modified")
-    search_fields = ("full_name", "id")
+    search_fields = ("full_name",)
 
 
 @admin.register(Genre)
-class GenreAdmin(admin.ModelAdmin):
+class GenreAdmin(SetWiseDeleteMixin, EstimatedCountMixin, IndexedSearchMixin, admin.ModelAdmin):
     
     list_display = ("name", "created", "modified")
-    search_fields = ("name", "id")
+    search_fields = ("name",)
 
 
 @admin.register(FilmWork)
-class FilmWorkAdmin(admin.ModelAdmin):
+class FilmWorkAdmin(SetWiseDeleteMixin, EstimatedCountMixin, IndexedSearchMixin, admin.ModelAdmin):
     inlines = (GenreFilmworkInline,)
+    actions = (assign_genre, change_type, delete_set_wise)
 
     list_display = ("title", "type", "creation_date", "rating", "created", "modified")
     list_filter = ("type",)
-    search_fields = ("title", "description", "id")
+    search_fields = ("title", "description")
@@ -0,0 +1,197 @@
+import base64
+import json
+import logging
+import uuid
+from datetime import date
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.db.models import BooleanField, F, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+
+from movies import cache
+from movies.documents import build_document, with_links
+from movies.export import CONTENT_TYPES, FORMATS, ExportStats, export_lines
+from movies.models import NULL_CREATION_DATE, NULL_RATING, FilmWork
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+# newest first, films without a date or a rating last, in the order of
+# film_work_creation_rate_idx read backwards
+ORDERING = (
+    Coalesce("creation_date", Value(NULL_CREATION_DATE)).desc(),
+    Coalesce("rating", Value(NULL_RATING)).desc(),
+    F("id").desc(),
+)
+CURSOR_COLUMNS = ("creation_date", "rating", "id")
+BEFORE_CURSOR_SQL = (
+    "(coalesce(creation_date, %s), coalesce(rating, %s), id) < (%s, %s, %s)"
+)
+
+
+class MoviesApiMixin:
+    """Film works served from their materialized documents, so a page is
+    a single query whatever the number of films
+    """
+
+    http_method_names = ["get"]
+
+    def get_queryset(self):
+        return FilmWork.objects.select_related("document").only(
+            *CURSOR_COLUMNS, "document__document"
+        )
+
+    def get_documents(self, film_works: list[FilmWork]) -> list[dict]:
+        """Documents of the film works, the ones not refreshed yet are built
+        from the tables in three more queries
+        """
+        missing = [film_work.pk for film_work in film_works if not hasattr(film_work, "document")]
+        built = {}
+        if missing:
+            queryset = with_links(FilmWork.objects.filter(pk__in=missing))
+            built = {film_work.pk: build_document(film_work) for film_work in queryset}
+        return [
+            built[film_work.pk] if film_work.pk in built else film_work.document.document
+            for film_work in film_works
+        ]
+
+
+class MoviesListApi(MoviesApiMixin, View):
+    """Pages of film works addressed by a cursor instead of an offset.
+
+    The cursor holds the sort key of the last film of the previous page,
+    so every page is an index range scan however deep it is.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page_size = _page_size(request.GET.get("page_size"))
+            cursor = decode_cursor(request.GET.get("cursor"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        page_key = f"{page_size}:{request.GET.get('cursor', '')}"
+        page = cache.lookup(cache.FILM_WORK_PAGE, page_key)
+        if page is None:
+            page = self.get_page(cursor, page_size)
+            cache.store(cache.FILM_WORK_PAGE, page_key, page)
+        results, next_cursor = page
+
+        next_url = None
+        if next_cursor is not None:
+            query = request.GET.copy()
+            query["cursor"] = next_cursor
+            next_url = request.build_absolute_uri(f"?{query.urlencode()}")
+        return JsonResponse({"next": next_url, "results": results})
+
+    def get_page(self, cursor: tuple | None, page_size: int) -> tuple[list[dict], str | None]:
+        queryset = self.get_queryset().order_by(*ORDERING)
+        if cursor is not None:
+            queryset = queryset.filter(
+                RawSQL(
+                    BEFORE_CURSOR_SQL,
+                    _db_values((NULL_CREATION_DATE, NULL_RATING, *cursor), queryset.db),
+                    output_field=BooleanField(),
+                )
+            )
+        # one more film tells whether there is a next page
+        film_works = list(queryset[:page_size + 1])
+
+        next_cursor = None
+        if len(film_works) > page_size:
+            film_works = film_works[:page_size]
+            next_cursor = encode_cursor(film_works[-1])
+        return self.get_documents(film_works), next_cursor
+
+
+class MoviesDetailApi(MoviesApiMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        key = str(kwargs["pk"])
+        document = cache.lookup(cache.FILM_WORK, key)
+        if document is None:
+            film_work = self.get_queryset().filter(pk=kwargs["pk"]).first()
+            if film_work is None:
+                return JsonResponse({"error": "Film work not found"}, status=404)
+            document = self.get_documents([film_work])[0]
+            cache.store(cache.FILM_WORK, key, document)
+        return JsonResponse(document)
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class MoviesExportApi(View):
+    """The whole catalogue streamed as NDJSON or CSV, for the staff only"""
+
+    http_method_names = ["get"]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "ndjson")
+        if export_format not in FORMATS:
+            return JsonResponse({"error": f"format must be one of {', '.join(FORMATS)}"}, status=400)
+
+        stats = ExportStats()
+        response = StreamingHttpResponse(
+            _logged(export_lines(export_format, stats), stats),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="film_works.{export_format}"'
+        return response
+
+
+def _logged(lines, stats: ExportStats):
+    yield from lines
+    logger.info(stats.summary())
+
+
+def encode_cursor(film_work: FilmWork) -> str:
+    creation_date = film_work.creation_date
+    key = [
+        creation_date.isoformat() if creation_date is not None else None,
+        film_work.rating,
+        str(film_work.id),
+    ]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> tuple[date, float, uuid.UUID] | None:
+    """The sort key of the cursor, with the NULL keys replaced by the values
+    they are sorted as
+    """
+    if not cursor:
+        return None
+    try:
+        creation_date, rating, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        return (
+            date.fromisoformat(creation_date) if creation_date is not None else NULL_CREATION_DATE,
+            float(rating) if rating is not None else NULL_RATING,
+            uuid.UUID(pk),
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _page_size(value: str | None) -> int:
+    if value is None:
+        return PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError as e:
+        raise ValueError("page_size must be an integer") from e
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+
+def _db_values(values: tuple, using: str) -> list:
+    """The NULL keys and the cursor as parameters of BEFORE_CURSOR_SQL"""
+    connection = connections[using]
+    return [
+        FilmWork._meta.get_field(column).get_db_prep_value(value, connection)
+        for column, value in zip(CURSOR_COLUMNS[:2] + CURSOR_COLUMNS, values)
+    ]
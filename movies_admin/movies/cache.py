@@ -0,0 +1,91 @@
+"""Cache of the movies app with hit and miss counters per namespace
+
+Namespaces which can't list their keys, like autocomplete results, are
+invalidated by bumping a version which is part of every key. Counters
+are kept in the cache itself, so they are shared by the processes of a
+shared backend.
+"""
+from django.core.cache import caches
+
+CACHE_ALIAS = "default"
+AUTOCOMPLETE = "autocomplete"
+FILM_WORK = "film_work"
+FILM_WORK_PAGE = "film_work_page"
+NAMESPACES = (
+    f"{AUTOCOMPLETE}.filmwork",
+    f"{AUTOCOMPLETE}.genre",
+    f"{AUTOCOMPLETE}.person",
+    FILM_WORK,
+    FILM_WORK_PAGE,
+)
+COUNTERS = ("hits", "misses")
+
+
+def lookup(namespace: str, key: str):
+    value = _cache().get(_key(namespace, key))
+    _count(namespace, "misses" if value is None else "hits")
+    return value
+
+
+def store(namespace: str, key: str, value) -> None:
+    _cache().set(_key(namespace, key), value)
+
+
+def delete_many(namespace: str, keys) -> None:
+    _cache().delete_many([_key(namespace, key) for key in keys])
+
+
+def invalidate(namespace: str) -> None:
+    """Drop every key of the namespace at once"""
+    cache = _cache()
+    version_key = f"{namespace}:version"
+    if not cache.add(version_key, 2, timeout=None):
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(version_key, 2, timeout=None)
+
+
+def forget_film_works(film_work_ids) -> None:
+    """Drop the documents of the film works and every cached page"""
+    delete_many(FILM_WORK, [str(pk) for pk in film_work_ids])
+    invalidate(FILM_WORK_PAGE)
+
+
+def stats() -> dict[str, dict[str, int]]:
+    cache = _cache()
+    values = cache.get_many(
+        [f"{namespace}:{counter}" for namespace in NAMESPACES for counter in COUNTERS]
+    )
+    return {
+        namespace: {
+            counter: values.get(f"{namespace}:{counter}", 0) for counter in COUNTERS
+        }
+        for namespace in NAMESPACES
+    }
+
+
+def reset_stats() -> None:
+    _cache().delete_many(
+        [f"{namespace}:{counter}" for namespace in NAMESPACES for counter in COUNTERS]
+    )
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _key(namespace: str, key: str) -> str:
+    version = _cache().get_or_set(f"{namespace}:version", 1, timeout=None)
+    return f"{namespace}:{version}:{key}"
+
+
+def _count(namespace: str, counter: str) -> None:
+    cache = _cache()
+    counter_key = f"{namespace}:{counter}"
+    if not cache.add(counter_key, 1, timeout=None):
+        try:
+            cache.incr(counter_key)
+        except ValueError:
+            cache.set(counter_key, 1, timeout=None)
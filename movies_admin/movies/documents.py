@@ -0,0 +1,94 @@
+from django.db import connections, transaction
+from django.db.models import Prefetch, QuerySet
+
+from movies import cache
+from movies.choices import RoleChoices
+from movies.models import FilmWork, Genre, PersonFilmwork
+
+REFRESH_SQL = "SELECT content.refresh_film_work_documents(%s::uuid[])"
+REFRESH_BATCH_SIZE = 1000
+DOCUMENT_FIELDS = ("id", "title", "description", "creation_date", "rating", "type")
+
+
+def with_links(queryset: QuerySet) -> QuerySet:
+    """Film works with what build_document needs, in three queries"""
+    return queryset.only(*DOCUMENT_FIELDS).prefetch_related(
+        Prefetch("genres", queryset=Genre.objects.only("name").order_by("name")),
+        Prefetch(
+            "personfilmwork_set",
+            queryset=PersonFilmwork.objects.select_related("person")
+            .only("role", "film_work", "person__full_name")
+            .order_by("person__full_name"),
+        ),
+    )
+
+
+def build_document(film_work: FilmWork) -> dict:
+    """The document of a film work loaded with_links, as the database builds it"""
+    persons = {f"{role}s": [] for role in RoleChoices.values}
+    for link in film_work.personfilmwork_set.all():
+        persons[f"{link.role}s"].append(link.person.full_name)
+    return {
+        "id": film_work.id,
+        "title": film_work.title,
+        "description": film_work.description,
+        "creation_date": film_work.creation_date,
+        "rating": film_work.rating,
+        "type": film_work.type,
+        "genres": [genre.name for genre in film_work.genres.all()],
+        **persons,
+    }
+
+
+def refresh_documents(film_work_ids, using: str = "default") -> int:
+    """Rebuild the documents of the film works, returns how many changed"""
+    film_work_ids = [str(pk) for pk in film_work_ids]
+    refreshed = 0
+    with connections[using].cursor() as cursor:
+        for start in range(0, len(film_work_ids), REFRESH_BATCH_SIZE):
+            cursor.execute(REFRESH_SQL, [film_work_ids[start:start + REFRESH_BATCH_SIZE]])
+            refreshed += cursor.fetchone()[0]
+    return refreshed
+
+
+class PendingRefresh:
+    """on_commit callback collecting the film works changed in a transaction"""
+
+    def __init__(self, using: str) -> None:
+        self.using = using
+        self.film_work_ids = set()
+        self.done = False
+
+    def __call__(self) -> None:
+        self.done = True
+        refresh_documents(self.film_work_ids, self.using)
+        cache.forget_film_works(self.film_work_ids)
+
+
+def schedule_refresh(film_work_ids, using: str = "default") -> None:
+    """Refresh the documents once the current transaction commits.
+
+    Saving a film with its inlines changes many rows, so the ids are
+    collected over the transaction and every document is rebuilt once.
+    The callback is looked up among the on_commit callbacks of the
+    connection, which Django drops on rollback. Callbacks run by
+    TestCase.captureOnCommitCallbacks stay in the list, so the ones
+    which already ran are skipped.
+    """
+    connection = connections[using]
+    pending = next(
+        (
+            entry[1]
+            for entry in connection.run_on_commit
+            if isinstance(entry[1], PendingRefresh) and not entry[1].done
+        ),
+        None,
+    )
+    if pending is not None:
+        pending.film_work_ids.update(film_work_ids)
+        return
+
+    pending = PendingRefresh(using)
+    pending.film_work_ids.update(film_work_ids)
+    # outside of a transaction the callback runs right away
+    transaction.on_commit(pending, using=using)
@@ -0,0 +1,114 @@
+import csv
+import json
+import resource
+import sys
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from movies.documents import build_document, with_links
+from movies.models import FilmWork
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# film works fetched from the server-side cursor and prefetched at once
+EXPORT_CHUNK_SIZE = 2000
+# rows joined into one piece of the output
+BUFFER_ROWS = 500
+CSV_COLUMNS = (
+    "id",
+    "title",
+    "description",
+    "creation_date",
+    "rating",
+    "type",
+    "genres",
+    "actors",
+    "directors",
+    "writers",
+)
+CSV_LIST_SEPARATOR = "|"
+
+
+@dataclass
+class ExportStats:
+    rows: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.rows} film works exported in {self.seconds:.1f} s "
+            f"({self.rows_per_sec:.0f} rows/s)"
+        )
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Echo:
+    """File-like object for csv.writer which returns the line instead of
+    writing it
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_documents(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+    """All film works with their genres and persons.
+
+    Rows are read from a server-side cursor chunk_size at a time and the
+    links of every chunk are prefetched in two queries, so memory holds
+    one chunk whatever the size of the table.
+    """
+    queryset = with_links(FilmWork.objects.all())
+    for film_work in queryset.iterator(chunk_size=chunk_size):
+        yield build_document(film_work)
+
+
+def export_lines(
+    export_format: str, stats: ExportStats, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[str]:
+    """The catalogue in export_format, yielded in pieces of BUFFER_ROWS rows"""
+    if export_format == "ndjson":
+        to_line = _ndjson_line
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_COLUMNS)
+        to_line = partial(_csv_line, writer)
+
+    buffer = []
+    for document in iter_documents(chunk_size):
+        buffer.append(to_line(document))
+        stats.rows += 1
+        if len(buffer) >= BUFFER_ROWS:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+    stats.seconds = time.perf_counter() - stats.started
+
+
+def _ndjson_line(document: dict) -> str:
+    return json.dumps(document, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def _csv_line(writer, document: dict) -> str:
+    return writer.writerow(
+        [
+            CSV_LIST_SEPARATOR.join(value) if isinstance(value, list) else value
+            for value in (document[column] for column in CSV_COLUMNS)
+        ]
+    )
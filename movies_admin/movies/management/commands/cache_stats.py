@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from movies import cache
+
+
+class Command(BaseCommand):
+    help = "Print hit and miss counters of the movies cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="zero the counters after printing")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'namespace':<22} {'hits':>10} {'misses':>10} {'hit ratio':>10}")
+        for namespace, counters in cache.stats().items():
+            lookups = counters["hits"] + counters["misses"]
+            ratio = f"{counters['hits'] / lookups:.1%}" if lookups else "-"
+            self.stdout.write(
+                f"{namespace:<22} {counters['hits']:>10} {counters['misses']:>10} {ratio:>10}"
+            )
+        if options["reset"]:
+            cache.reset_stats()
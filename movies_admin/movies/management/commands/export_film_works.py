@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from movies.export import EXPORT_CHUNK_SIZE, FORMATS, ExportStats, export_lines, peak_rss_bytes
+
+
+class Command(BaseCommand):
+    help = "Export all film works with their genres and persons as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--output", help="file to write, stdout by default")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help="film works read from the database cursor at once",
+        )
+
+    def handle(self, *args, **options):
+        stats = ExportStats()
+        lines = export_lines(options["format"], stats, options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
+
+        peak_rss_mb = peak_rss_bytes() / 2**20
+        self.stderr.write(f"{stats.summary()}, peak RSS {peak_rss_mb:.0f} MB")
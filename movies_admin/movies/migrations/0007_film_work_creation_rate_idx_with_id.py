@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_trigram_search_indexes'),
+    ]
+
+    operations = [
+        # id completes the sort key of the API pages, so the row comparison
+        # with the cursor is a single index condition
+        migrations.RemoveIndex(
+            model_name='filmwork',
+            name='film_work_creation_rate_idx',
+        ),
+        migrations.AddIndex(
+            model_name='filmwork',
+            index=models.Index(fields=['creation_date', 'rating', 'id'], name='film_work_creation_rate_idx'),
+        ),
+    ]
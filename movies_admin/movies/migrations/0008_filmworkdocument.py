@@ -0,0 +1,85 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+REFRESH_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION content.refresh_film_work_documents(ids uuid[])
+RETURNS integer AS $$
+    WITH documents AS (
+        SELECT
+            fw.id,
+            jsonb_build_object(
+                'id', fw.id,
+                'title', fw.title,
+                'description', fw.description,
+                'creation_date', fw.creation_date,
+                'rating', fw.rating,
+                'type', fw.type,
+                'genres', coalesce((
+                    SELECT jsonb_agg(g.name ORDER BY g.name)
+                    FROM content.genre_film_work gfw
+                    JOIN content.genre g ON g.id = gfw.genre_id
+                    WHERE gfw.film_work_id = fw.id
+                ), '[]'),
+                'actors', coalesce(persons.names -> 'actor', '[]'),
+                'directors', coalesce(persons.names -> 'director', '[]'),
+                'writers', coalesce(persons.names -> 'writer', '[]')
+            ) AS document
+        FROM content.film_work fw
+        LEFT JOIN LATERAL (
+            SELECT jsonb_object_agg(roles.role, roles.names) AS names
+            FROM (
+                SELECT pfw.role, jsonb_agg(p.full_name ORDER BY p.full_name) AS names
+                FROM content.person_film_work pfw
+                JOIN content.person p ON p.id = pfw.person_id
+                WHERE pfw.film_work_id = fw.id
+                GROUP BY pfw.role
+            ) roles
+        ) persons ON true
+        WHERE fw.id = ANY(ids)
+    ), deleted AS (
+        DELETE FROM content.film_work_document d
+        WHERE d.film_work_id = ANY(ids)
+            AND NOT EXISTS (SELECT 1 FROM content.film_work fw WHERE fw.id = d.film_work_id)
+    ), refreshed AS (
+        INSERT INTO content.film_work_document (film_work_id, document, modified)
+        SELECT id, document, now() FROM documents
+        ON CONFLICT (film_work_id) DO UPDATE
+        SET document = EXCLUDED.document, modified = EXCLUDED.modified
+        WHERE content.film_work_document.document IS DISTINCT FROM EXCLUDED.document
+        RETURNING 1
+    )
+    SELECT count(*)::integer FROM refreshed;
+$$ LANGUAGE sql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_film_work_creation_rate_idx_with_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmWorkDocument',
+            fields=[
+                ('film_work', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='movies.filmwork')),
+                ('document', models.JSONField()),
+                ('modified', models.DateTimeField(verbose_name='Modified at')),
+            ],
+            options={
+                'db_table': 'content"."film_work_document',
+            },
+        ),
+        migrations.RunSQL(
+            sql=REFRESH_FUNCTION_SQL,
+            reverse_sql='DROP FUNCTION IF EXISTS content.refresh_film_work_documents(uuid[]);',
+        ),
+        migrations.RunSQL(
+            sql='SELECT content.refresh_film_work_documents(array(SELECT id FROM content.film_work));',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.5 on 2026-10-18 19:06
+
+import datetime
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_filmworkdocument'),
+    ]
+
+    operations = [
+        # schema_design/movies_database.ddl and the ETL allow film works
+        # without a creation date or a rating, the model now says so. The
+        # API sorts those NULLs below every value, so the index holds the
+        # same coalesce expressions as its ORDER BY
+        migrations.RemoveIndex(
+            model_name='filmwork',
+            name='film_work_creation_rate_idx',
+        ),
+        migrations.AlterField(
+            model_name='filmwork',
+            name='creation_date',
+            field=models.DateField(null=True, verbose_name='Creation date'),
+        ),
+        migrations.AlterField(
+            model_name='filmwork',
+            name='rating',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(10)], verbose_name='Rating'),
+        ),
+        migrations.AddIndex(
+            model_name='filmwork',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('creation_date', models.Value(datetime.date(1, 1, 1))), django.db.models.functions.comparison.Coalesce('rating', models.Value(float("-inf"))), models.F('id'), name='film_work_creation_rate_idx'),
+        ),
+    ]
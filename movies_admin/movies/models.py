@@ -1,5 +1,9 @@
 import uuid
+from datetime import date
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Coalesce, Upper
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
@@ -33,6 +37,9 @@ class Genre(UUIDMixin, TimeStampedMixin):
     class Meta:
 
         db_table = "content\".\"genre"
+        indexes = [
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='genre_name_trgm_idx'),
+        ]
 
         verbose_name = _("Genre")
         verbose_name_plural = _("Genres")
@@ -42,15 +49,21 @@ class Genre(UUIDMixin, TimeStampedMixin):
         return self.name 
 
 
+# NULL sort keys of film works, sorted below every date and rating
+NULL_CREATION_DATE = date.min
+NULL_RATING = float("-inf")
+
+
 class FilmWork(UUIDMixin, TimeStampedMixin):
 
     title = models.CharField(verbose_name=_("Title"), max_length=255)
     file_path = models.TextField(verbose_name=_("File path"), blank=True)
     description = models.TextField(verbose_name=_("Description"), blank=True)
-    creation_date = models.DateField(verbose_name=_("Creation date"))
+    creation_date = models.DateField(verbose_name=_("Creation date"), null=True)
     rating = models.FloatField(
         verbose_name=_("Rating"),
         blank=True,
+        null=True,
         validators=[MinValueValidator(0), MaxValueValidator(10)]
     )
     type = models.CharField(verbose_name=_("Type"), max_length=255, choices=FilmWorkType.choices)
@@ -60,7 +73,17 @@ class FilmWork(UUIDMixin, TimeStampedMixin):
 
         db_table = "content\".\"film_work"
         indexes = [
-            models.Index(fields=['creation_date', 'rating'], name='film_work_creation_rate_idx'),
+            models.Index(
+                Coalesce('creation_date', models.Value(NULL_CREATION_DATE)),
+                Coalesce('rating', models.Value(NULL_RATING)),
+                'id',
+                name='film_work_creation_rate_idx',
+            ),
+            GinIndex(OpClass(Upper('title'), name='gin_trgm_ops'), name='film_work_title_trgm_idx'),
+            GinIndex(
+                OpClass(Upper('description'), name='gin_trgm_ops'),
+                name='film_work_description_trgm_idx',
+            ),
         ]
 
 
@@ -96,6 +119,9 @@ class Person(UUIDMixin, TimeStampedMixin):
     class Meta:
 
         db_table = "content\".\"person"
+        indexes = [
+            GinIndex(OpClass(Upper('full_name'), name='gin_trgm_ops'), name='person_full_name_trgm_idx'),
+        ]
 
         verbose_name = _("Person")
         verbose_name_plural = _("Persons")
@@ -121,4 +147,22 @@ class PersonFilmwork(UUIDMixin):
 
         verbose_name = _("Person filmwork")
         verbose_name_plural = _("Person filmworks")
-    
\ No newline at end of file
+    
+
+class FilmWorkDocument(models.Model):
+    """Film work with its genres and persons as one JSON document.
+
+    Filled by the content.refresh_film_work_documents(uuid[]) function of
+    the database, which the signals of the movies app and the ETL call
+    for the film works they change.
+    """
+
+    film_work = models.OneToOneField(
+        FilmWork, primary_key=True, on_delete=models.CASCADE, related_name='document'
+    )
+    document = models.JSONField()
+    modified = models.DateTimeField(verbose_name=_('Modified at'))
+
+    class Meta:
+
+        db_table = "content\".\"film_work_document"
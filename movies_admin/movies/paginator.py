@@ -0,0 +1,77 @@
+import json
+
+from django.core.paginator import Paginator
+from django.db import OperationalError, connections, transaction
+from django.utils.functional import cached_property
+
+ESTIMATE_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator which does not count large tables row by row.
+
+    An unfiltered list takes the row estimate of the table from pg_class,
+    unless the table is small enough to count. A filtered list is counted
+    with a statement timeout, and when the count is cancelled the planner
+    estimate of the query is shown instead. With exact=True the list is
+    always counted.
+    """
+
+    # tables with fewer rows by estimate are counted exactly
+    estimate_threshold = 10_000
+    count_timeout_ms = 200
+
+    def __init__(self, *args, exact: bool = False, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.exact = exact
+        self.estimated = False
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if self.exact or not hasattr(queryset, "query"):
+            return super().count
+
+        if not queryset.query.where:
+            estimate = self._table_estimate(queryset)
+            if estimate >= self.estimate_threshold:
+                self.estimated = True
+                return estimate
+            return super().count
+
+        try:
+            return self._count_with_timeout(queryset)
+        except OperationalError:
+            self.estimated = True
+            return estimate_count(queryset)
+
+    def _table_estimate(self, queryset) -> int:
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(ESTIMATE_SQL, [f'"{queryset.model._meta.db_table}"'])
+            row = cursor.fetchone()
+        # reltuples is -1 for tables which were never analyzed
+        return max(row[0], 0) if row else 0
+
+    def _count_with_timeout(self, queryset) -> int:
+        with transaction.atomic(using=queryset.db):
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("SHOW statement_timeout")
+                previous = cursor.fetchone()[0]
+                cursor.execute(f"SET LOCAL statement_timeout = {int(self.count_timeout_ms)}")
+                count = queryset.count()
+                # inside an outer transaction the released savepoint would
+                # keep the timeout for the rest of it, a cancelled count
+                # rolls the setting back with the savepoint
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+            return count
+
+
+def estimate_count(queryset) -> int:
+    """Rows the planner expects the queryset to return, without running it"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
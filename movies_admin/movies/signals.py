@@ -0,0 +1,64 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from movies import cache
+from movies.documents import schedule_refresh
+from movies.models import FilmWork, Genre, GenreFilmwork, Person, PersonFilmwork
+
+
+@receiver(post_save, sender=FilmWork)
+@receiver(post_delete, sender=FilmWork)
+def film_work_changed(sender, instance, using, **kwargs):
+    """A deleted film work drops its document and cached pages as well"""
+    schedule_refresh([instance.pk], using)
+
+
+@receiver(post_save, sender=GenreFilmwork)
+@receiver(post_delete, sender=GenreFilmwork)
+@receiver(post_save, sender=PersonFilmwork)
+@receiver(post_delete, sender=PersonFilmwork)
+def link_changed(sender, instance, using, **kwargs):
+    schedule_refresh([instance.film_work_id], using)
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, using, created, **kwargs):
+    if not created:
+        links = GenreFilmwork.objects.using(using).filter(genre=instance)
+        schedule_refresh(links.values_list("film_work_id", flat=True), using)
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, using, created, **kwargs):
+    if not created:
+        links = PersonFilmwork.objects.using(using).filter(person=instance)
+        schedule_refresh(links.values_list("film_work_id", flat=True), using)
+
+
+@receiver(m2m_changed, sender=GenreFilmwork)
+@receiver(m2m_changed, sender=PersonFilmwork)
+def links_changed(sender, instance, action, pk_set, using, **kwargs):
+    """Links added with FilmWork.genres or Person.film_works skip post_save"""
+    if isinstance(instance, FilmWork):
+        if action in ("post_add", "post_remove", "post_clear"):
+            schedule_refresh([instance.pk], using)
+    elif action in ("post_add", "post_remove"):
+        schedule_refresh(pk_set, using)
+    elif action == "pre_clear":
+        links = sender.objects.using(using).filter(**{instance._meta.model_name: instance})
+        schedule_refresh(links.values_list("film_work_id", flat=True), using)
+
+
+@receiver(post_save, sender=FilmWork)
+@receiver(post_delete, sender=FilmWork)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+def autocomplete_changed(sender, using, **kwargs):
+    namespace = f"{cache.AUTOCOMPLETE}.{sender._meta.model_name}"
+    # after the commit, so a concurrent request can't cache the old rows again
+    transaction.on_commit(partial(cache.invalidate, namespace), using=using)
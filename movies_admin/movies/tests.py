@@ -0,0 +1,528 @@
+import itertools
+from datetime import date
+from io import StringIO
+
+from django.contrib.admin import helpers
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from unittest import mock
+
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.test import TestCase
+from django.urls import reverse
+
+from movies import cache
+from movies.actions import BULK_CHUNK_SIZE, run_in_chunks
+from movies.paginator import EstimatedCountPaginator
+from movies.models import (
+    NULL_CREATION_DATE,
+    NULL_RATING,
+    FilmWork,
+    FilmWorkDocument,
+    Genre,
+    GenreFilmwork,
+    Person,
+    PersonFilmwork,
+)
+
+# session, user, savepoint, object, inline rows, release savepoint
+CHANGE_VIEW_QUERIES = 6
+
+
+class ChangeViewQueriesTest(TestCase):
+    """The change views run the same queries however many links are shown"""
+
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+        # content types are cached after the first lookup of the process
+        ContentType.objects.get_for_models(FilmWork, Genre, Person)
+
+    def create_film_work(self, title):
+        return FilmWork.objects.create(
+            title=title, creation_date="2020-01-01", rating=5, type="movie"
+        )
+
+    def assert_change_view_queries(self, obj):
+        url = reverse(f"admin:movies_{obj._meta.model_name}_change", args=(obj.pk,))
+        with self.assertNumQueries(CHANGE_VIEW_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_film_work_genres(self):
+        for links in (1, 50):
+            with self.subTest(links=links):
+                film_work = self.create_film_work(f"Film with {links} genres")
+                for i in range(links):
+                    genre = Genre.objects.create(name=f"Genre {links}-{i}")
+                    GenreFilmwork.objects.create(film_work=film_work, genre=genre)
+
+                response = self.assert_change_view_queries(film_work)
+                self.assertContains(response, f"Genre {links}-{links - 1}")
+
+    def test_person_film_works(self):
+        for links in (1, 50):
+            with self.subTest(links=links):
+                person = Person.objects.create(full_name=f"Person with {links} roles")
+                for i in range(links):
+                    film_work = self.create_film_work(f"Film {links}-{i}")
+                    PersonFilmwork.objects.create(film_work=film_work, person=person, role="actor")
+
+                response = self.assert_change_view_queries(person)
+                self.assertContains(response, f"Film {links}-{links - 1}")
+
+
+class MoviesListApiTest(TestCase):
+    """The cursor pages of the API cover the films without a date or a rating"""
+
+    def setUp(self):
+        caches[cache.CACHE_ALIAS].clear()
+
+    def test_pages_with_null_keys(self):
+        dates = (None, date(2020, 1, 1), date(2021, 1, 1))
+        ratings = (None, 5.0, 7.5)
+        for i, (creation_date, rating) in enumerate(itertools.product(dates, ratings)):
+            for copy in range(2):
+                FilmWork.objects.create(
+                    title=f"Film {i}-{copy}", creation_date=creation_date, rating=rating, type="movie"
+                )
+        expected = [
+            str(film_work.pk)
+            for film_work in sorted(
+                FilmWork.objects.all(),
+                key=lambda film_work: (
+                    film_work.creation_date or NULL_CREATION_DATE,
+                    NULL_RATING if film_work.rating is None else film_work.rating,
+                    film_work.pk,
+                ),
+                reverse=True,
+            )
+        ]
+
+        seen = []
+        url = "/api/v1/movies/?page_size=4"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen += [document["id"] for document in data["results"]]
+            url = data["next"]
+        self.assertEqual(seen, expected)
+
+
+class AdminSearchTest(TestCase):
+    """Admin search matches the trigram indexed expressions of every field"""
+
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+
+    def search(self, model, term):
+        url = reverse(f"admin:movies_{model._meta.model_name}_changelist")
+        response = self.client.get(url, {"q": term})
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"].result_list
+
+    def assert_found(self, model, term, expected, field, index):
+        self.assertCountEqual(self.search(model, term), expected)
+        # icontains compiles to UPPER(field::text) LIKE, the indexed expression
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = model.objects.filter(**{f"{field}__icontains": term}).explain()
+        self.assertIn(index, plan)
+
+    def test_fields(self):
+        matrix = FilmWork.objects.create(
+            title="The Matrix", description="A hacker learns the truth", type="movie"
+        )
+        FilmWork.objects.create(title="Heat", description="A crew of thieves", type="movie")
+        drama = Genre.objects.create(name="Drama")
+        Genre.objects.create(name="Comedy")
+        keanu = Person.objects.create(full_name="Keanu Reeves")
+        Person.objects.create(full_name="Al Pacino")
+
+        self.assert_found(FilmWork, "matrix", [matrix], "title", "film_work_title_trgm_idx")
+        self.assert_found(
+            FilmWork, "HACKER", [matrix], "description", "film_work_description_trgm_idx"
+        )
+        self.assert_found(Genre, "dra", [drama], "name", "genre_name_trgm_idx")
+        self.assert_found(Person, "reeves", [keanu], "full_name", "person_full_name_trgm_idx")
+
+    def test_terms(self):
+        matrix = FilmWork.objects.create(title="The Matrix", description="Neo", type="movie")
+        FilmWork.objects.create(title="The Matrix Reloaded", description="Smith", type="movie")
+
+        # every term has to match one of the fields
+        self.assertEqual(list(self.search(FilmWork, "matrix neo")), [matrix])
+        self.assertEqual(list(self.search(FilmWork, '"matrix reloaded" neo')), [])
+        self.assertEqual(list(self.search(FilmWork, str(matrix.pk))), [matrix])
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    """Changelist counts come from estimates only for large tables and slow counts"""
+
+    def setUp(self):
+        for i in range(30):
+            FilmWork.objects.create(title=f"Film {i}", type="movie" if i % 3 else "tv_show")
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE "content"."film_work"')
+
+    def statement_timeout(self) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW statement_timeout")
+            return cursor.fetchone()[0]
+
+    def test_small_table(self):
+        paginator = EstimatedCountPaginator(FilmWork.objects.order_by("pk"), 10)
+        self.assertEqual(paginator.count, 30)
+        self.assertFalse(paginator.estimated)
+
+    def test_large_table(self):
+        paginator = EstimatedCountPaginator(FilmWork.objects.order_by("pk"), 10)
+        paginator.estimate_threshold = 10
+        # ANALYZE of a small table reads every row
+        self.assertEqual(paginator.count, 30)
+        self.assertTrue(paginator.estimated)
+
+        paginator = EstimatedCountPaginator(FilmWork.objects.order_by("pk"), 10, exact=True)
+        paginator.estimate_threshold = 10
+        FilmWork.objects.create(title="Film 30", type="movie")
+        self.assertEqual(paginator.count, 31)
+        self.assertFalse(paginator.estimated)
+
+    def test_filtered_count(self):
+        previous = self.statement_timeout()
+        paginator = EstimatedCountPaginator(FilmWork.objects.filter(type="tv_show").order_by("pk"), 10)
+        self.assertEqual(paginator.count, 10)
+        self.assertFalse(paginator.estimated)
+        # the test runs in a transaction, like a request with ATOMIC_REQUESTS
+        self.assertEqual(self.statement_timeout(), previous)
+
+    def test_cancelled_count(self):
+        previous = self.statement_timeout()
+        slow = RawSQL("pg_sleep(0.01) IS NOT NULL", [], output_field=BooleanField())
+        paginator = EstimatedCountPaginator(FilmWork.objects.filter(slow).order_by("pk"), 10)
+        paginator.count_timeout_ms = 50
+        self.assertGreater(paginator.count, 0)
+        self.assertTrue(paginator.estimated)
+        self.assertEqual(self.statement_timeout(), previous)
+
+    def test_exact_count_link(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+        url = reverse("admin:movies_filmwork_changelist")
+        with mock.patch.object(EstimatedCountPaginator, "estimate_threshold", 10):
+            response = self.client.get(url)
+            self.assertTrue(response.context["cl"].paginator.estimated)
+            self.assertContains(response, "?exact_count=1")
+
+            response = self.client.get(url, {"exact_count": "1"})
+            self.assertFalse(response.context["cl"].paginator.estimated)
+            self.assertEqual(response.context["cl"].result_count, 30)
+
+
+class FilmWorkDocumentTest(TestCase):
+    """Documents follow the changes of the film works, their links and the
+    linked genres and persons once the transaction commits
+    """
+
+    def setUp(self):
+        caches[cache.CACHE_ALIAS].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film_work = FilmWork.objects.create(title="The Matrix", type="movie")
+            self.genre = Genre.objects.create(name="Action")
+            self.person = Person.objects.create(full_name="Keanu Reeves")
+
+    def document(self) -> dict:
+        return FilmWorkDocument.objects.get(film_work=self.film_work).document
+
+    def test_film_work_saved(self):
+        self.assertEqual(self.document()["title"], "The Matrix")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film_work.title = "The Matrix Reloaded"
+            self.film_work.save()
+        self.assertEqual(self.document()["title"], "The Matrix Reloaded")
+
+    def test_links_changed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            genre_link = GenreFilmwork.objects.create(film_work=self.film_work, genre=self.genre)
+            PersonFilmwork.objects.create(film_work=self.film_work, person=self.person, role="actor")
+        self.assertEqual(self.document()["genres"], ["Action"])
+        self.assertEqual(self.document()["actors"], ["Keanu Reeves"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            genre_link.delete()
+        self.assertEqual(self.document()["genres"], [])
+
+    def test_genre_and_person_renamed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            GenreFilmwork.objects.create(film_work=self.film_work, genre=self.genre)
+            PersonFilmwork.objects.create(film_work=self.film_work, person=self.person, role="actor")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.name = "Sci-Fi"
+            self.genre.save()
+            self.person.full_name = "Carrie-Anne Moss"
+            self.person.save()
+        self.assertEqual(self.document()["genres"], ["Sci-Fi"])
+        self.assertEqual(self.document()["actors"], ["Carrie-Anne Moss"])
+
+    def test_no_refresh_before_commit(self):
+        self.film_work.title = "The Matrix Reloaded"
+        self.film_work.save()
+        self.assertEqual(self.document()["title"], "The Matrix")
+
+    def test_api_reads_stored_document(self):
+        stored = {**self.document(), "title": "Stored title"}
+        FilmWorkDocument.objects.filter(film_work=self.film_work).update(document=stored)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/v1/movies/{self.film_work.pk}/")
+        self.assertEqual(response.json()["title"], "Stored title")
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/movies/")
+        self.assertEqual(response.json()["results"][0]["title"], "Stored title")
+
+
+class BulkActionsTest(TestCase):
+    """Set-based admin actions change every selected row, chunk by chunk"""
+
+    def setUp(self):
+        caches[cache.CACHE_ALIAS].clear()
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film_works = [
+                FilmWork.objects.create(title=f"Film {i}", type="movie") for i in range(5)
+            ]
+            self.genre = Genre.objects.create(name="Drama")
+            self.person = Person.objects.create(full_name="Al Pacino")
+            for film_work in self.film_works:
+                GenreFilmwork.objects.create(film_work=film_work, genre=self.genre)
+                PersonFilmwork.objects.create(film_work=film_work, person=self.person, role="actor")
+
+    def run_action(self, model, action, objects, query="", **data):
+        url = reverse(f"admin:movies_{model._meta.model_name}_changelist") + query
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                url,
+                {
+                    "action": action,
+                    helpers.ACTION_CHECKBOX_NAME: [str(obj.pk) for obj in objects],
+                    "post": "yes",
+                    **data,
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+
+    def test_confirmation(self):
+        url = reverse("admin:movies_filmwork_changelist")
+        response = self.client.post(
+            url,
+            {
+                "action": "delete_set_wise",
+                helpers.ACTION_CHECKBOX_NAME: [str(self.film_works[0].pk)],
+            },
+        )
+        self.assertTemplateUsed(response, "admin/movies/bulk_action_confirmation.html")
+        self.assertTrue(FilmWork.objects.filter(pk=self.film_works[0].pk).exists())
+
+    def test_delete_film_works(self):
+        deleted, kept = self.film_works[:3], self.film_works[3:]
+        self.run_action(FilmWork, "delete_set_wise", deleted)
+
+        self.assertCountEqual(FilmWork.objects.all(), kept)
+        self.assertEqual(GenreFilmwork.objects.count(), len(kept))
+        self.assertEqual(PersonFilmwork.objects.count(), len(kept))
+        self.assertCountEqual(
+            FilmWorkDocument.objects.values_list("film_work", flat=True),
+            [film_work.pk for film_work in kept],
+        )
+        self.assertCountEqual(
+            LogEntry.objects.filter(action_flag=DELETION, user=self.user).values_list(
+                "object_id", "object_repr"
+            ),
+            [(str(film_work.pk), film_work.title) for film_work in deleted],
+        )
+
+    def test_delete_genre_and_person(self):
+        self.run_action(Genre, "delete_set_wise", [self.genre])
+        self.run_action(Person, "delete_set_wise", [self.person])
+
+        self.assertFalse(GenreFilmwork.objects.exists())
+        self.assertFalse(PersonFilmwork.objects.exists())
+        for film_work in FilmWork.objects.select_related("document"):
+            self.assertEqual(film_work.document.document["genres"], [])
+            self.assertEqual(film_work.document.document["actors"], [])
+        self.assertEqual(LogEntry.objects.filter(action_flag=DELETION).count(), 2)
+
+    def test_delete_more_than_a_chunk(self):
+        FilmWork.objects.bulk_create(
+            FilmWork(title=f"Bulk {i}", type="movie") for i in range(BULK_CHUNK_SIZE + 1)
+        )
+        # more ids than a form may post, the whole search result is selected
+        # along with the ids of the page
+        page = FilmWork.objects.filter(title__startswith="Bulk")[:1]
+        self.run_action(FilmWork, "delete_set_wise", page, query="?q=Bulk", select_across="1")
+
+        self.assertCountEqual(FilmWork.objects.all(), self.film_works)
+        self.assertEqual(
+            LogEntry.objects.filter(action_flag=DELETION).count(), BULK_CHUNK_SIZE + 1
+        )
+
+    def test_chunks(self):
+        calls = []
+        with mock.patch("movies.actions.BULK_CHUNK_SIZE", 2):
+            affected = run_in_chunks(
+                FilmWork.objects.all(), lambda ids, using: calls.append(ids) or len(ids)
+            )
+        self.assertEqual(affected, len(self.film_works))
+        self.assertEqual([len(ids) for ids in calls], [2, 2, 1])
+        self.assertEqual(
+            sum(calls, []), sorted(str(film_work.pk) for film_work in self.film_works)
+        )
+
+    def test_assign_genre(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            comedy = Genre.objects.create(name="Comedy")
+            GenreFilmwork.objects.create(film_work=self.film_works[0], genre=comedy)
+        with mock.patch("movies.actions.BULK_CHUNK_SIZE", 2):
+            self.run_action(FilmWork, "assign_genre", self.film_works[:3], genre=str(comedy.pk))
+
+        self.assertCountEqual(
+            GenreFilmwork.objects.filter(genre=comedy).values_list("film_work", flat=True),
+            [film_work.pk for film_work in self.film_works[:3]],
+        )
+        self.assertEqual(
+            FilmWorkDocument.objects.get(film_work=self.film_works[1]).document["genres"],
+            ["Comedy", "Drama"],
+        )
+
+    def test_change_type(self):
+        self.run_action(FilmWork, "change_type", self.film_works[:2], type="tv_show")
+
+        self.assertCountEqual(FilmWork.objects.filter(type="tv_show"), self.film_works[:2])
+        self.assertEqual(
+            FilmWorkDocument.objects.get(film_work=self.film_works[0]).document["type"],
+            "tv_show",
+        )
+        self.assertEqual(
+            FilmWorkDocument.objects.get(film_work=self.film_works[2]).document["type"],
+            "movie",
+        )
+
+
+class MoviesExportApiTest(TestCase):
+    """The catalogue export is streamed to the staff only"""
+
+    url = "/api/v1/movies/export/"
+
+    def setUp(self):
+        FilmWork.objects.create(title="The Matrix", type="movie")
+
+    def test_anonymous(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response["Location"])
+
+    def test_not_staff(self):
+        self.client.force_login(User.objects.create_user("user", password="password"))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_staff(self):
+        self.client.force_login(
+            User.objects.create_user("staff", password="password", is_staff=True)
+        )
+        response = self.client.get(self.url, {"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("The Matrix", lines[1])
+
+
+class CacheInvalidationTest(TestCase):
+    """Cached autocomplete results, documents and API pages go stale once
+    the changes of their models commit
+    """
+
+    def setUp(self):
+        caches[cache.CACHE_ALIAS].clear()
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film_work = FilmWork.objects.create(title="The Matrix", type="movie")
+            self.genre = Genre.objects.create(name="Drama")
+            self.person = Person.objects.create(full_name="Keanu Reeves")
+
+    def test_autocomplete(self):
+        params = {
+            "app_label": "movies",
+            "model_name": "genrefilmwork",
+            "field_name": "genre",
+            "term": "dra",
+        }
+        for _ in range(2):
+            response = self.client.get("/admin/autocomplete/", params)
+            self.assertEqual(response.json()["results"][0]["text"], "Drama")
+        self.assertEqual(cache.stats()["autocomplete.genre"], {"hits": 1, "misses": 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.name = "Drama film"
+            self.genre.save()
+        response = self.client.get("/admin/autocomplete/", params)
+        self.assertEqual(response.json()["results"][0]["text"], "Drama film")
+
+    def test_models_bump_autocomplete_version(self):
+        for obj in (self.film_work, self.genre, self.person):
+            namespace = f"{cache.AUTOCOMPLETE}.{obj._meta.model_name}"
+            for change in (obj.save, obj.delete):
+                with self.subTest(model=obj._meta.model_name, change=change.__name__):
+                    cache.store(namespace, "key", b"[]")
+                    with self.captureOnCommitCallbacks(execute=True):
+                        change()
+                    self.assertIsNone(cache.lookup(namespace, "key"))
+
+    def test_api_document_and_pages(self):
+        detail_url = f"/api/v1/movies/{self.film_work.pk}/"
+        self.client.get(detail_url)
+        self.client.get("/api/v1/movies/")
+        # both are served from the cache now
+        with self.assertNumQueries(0):
+            self.client.get(detail_url)
+            self.client.get("/api/v1/movies/")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PersonFilmwork.objects.create(film_work=self.film_work, person=self.person, role="actor")
+        self.assertEqual(self.client.get(detail_url).json()["actors"], ["Keanu Reeves"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.person.full_name = "Carrie-Anne Moss"
+            self.person.save()
+        self.assertEqual(self.client.get(detail_url).json()["actors"], ["Carrie-Anne Moss"])
+        response = self.client.get("/api/v1/movies/")
+        self.assertEqual(response.json()["results"][0]["actors"], ["Carrie-Anne Moss"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.film_work.delete()
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+        self.assertEqual(self.client.get("/api/v1/movies/").json()["results"], [])
+
+    def test_cache_stats(self):
+        cache.store(cache.FILM_WORK, "stored", {})
+        cache.lookup(cache.FILM_WORK, "stored")
+        cache.lookup(cache.FILM_WORK, "stored")
+        cache.lookup(cache.FILM_WORK, "missing")
+
+        out = StringIO()
+        call_command("cache_stats", "--reset", stdout=out)
+        self.assertIn(f"{cache.FILM_WORK:<22} {2:>10} {1:>10} {'66.7%':>10}", out.getvalue())
+        self.assertIn(f"{cache.FILM_WORK_PAGE:<22} {0:>10} {0:>10} {'-':>10}", out.getvalue())
+        self.assertEqual(cache.stats()[cache.FILM_WORK], {"hits": 0, "misses": 0})
@@ -0,0 +1,21 @@
+from django.contrib.admin.widgets import AutocompleteSelect
+
+
+class LoadedAutocompleteSelect(AutocompleteSelect):
+    """Autocomplete which renders the selected option from the related
+    object loaded with the inline row, instead of querying it for every row
+    """
+
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        obj = self.selected
+        if obj is None or [str(v) for v in value] != [str(obj.pk)]:
+            return super().optgroups(name, value, attr)
+
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, "", "", False, 0))
+        label = self.choices.field.label_from_instance(obj)
+        options.append(self.create_option(name, obj.pk, label, True, len(options)))
+        return [(None, options, 0)]
@@ -0,0 +1,315 @@
+import asyncio
+import io
+import logging
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import count
+from typing import Any
+
+import asyncpg
+
+from dto import DTO_TABLES_MAPPING
+from etl import ConcreteETL, MultiStageETL, checkpoint_key
+from extractor import SQLiteMovieExtractor, connect_to_sqlite3
+from pipeline import PipelineStats
+from tuning import ChunkSizeTuner
+from validation import IDS_SQL, LINK_REFERENCES, PARENT_TABLES
+from saver import (
+    BASE_INSERT_STMT,
+    BASE_UPSERT_STMT,
+    DEFAULT_SCHEMA,
+    ID_UNIQUE_FIELDS,
+    MERGE_STMT,
+    STAGING_TABLE_STMT,
+    UNIQUE_FIELDS,
+    _to_copy_value,
+    _to_values,
+    format_insert_stmt,
+    get_dataclass_fields,
+)
+
+# SQLite keeps dates and timestamps as ISO strings, so they are sent in
+# the text format and parsed by Postgres, as with psycopg2
+TEXT_TYPES = ("date", "timestamptz")
+
+
+class BaseAsyncPostgresSaver(ABC):
+    def __init__(
+        self,
+        conn: asyncpg.Connection,
+        unique_fields: dict[str, tuple[str, ...]] = UNIQUE_FIELDS,
+    ):
+        self._conn = conn
+        self._unique_fields = unique_fields
+
+    @abstractmethod
+    async def save(self, table: str, items: list[Any]) -> None:
+        pass
+
+    async def _perform_insert(
+        self,
+        table: str,
+        stmt: str,
+        fields: tuple[str, ...],
+        unique_fields: tuple[str, ...],
+        items: list,
+    ) -> None:
+        # asyncpg prepares the statement on first use and keeps it in the
+        # statement cache of the connection
+        stmt = format_insert_stmt(stmt, table, fields, unique_fields)
+        try:
+            await self._conn.executemany(stmt, [_to_values(item, fields) for item in items])
+        except asyncpg.PostgresError as e:
+            logging.error(f"Error occurred while inserting data: {e}")
+            raise e
+
+    def _get_dataclass_fields(self, dataclass: type) -> tuple[str, ...]:
+        return get_dataclass_fields(dataclass)
+
+    def _get_unique_fields(self, table: str) -> tuple[str, ...]:
+        return self._unique_fields.get(table, ID_UNIQUE_FIELDS)
+
+
+class AsyncPostgresSaver(BaseAsyncPostgresSaver):
+    async def save(self, table: str, items: list[Any]) -> None:
+        await self._perform_insert(
+            table=table,
+            stmt=BASE_INSERT_STMT,
+            fields=self._get_dataclass_fields(DTO_TABLES_MAPPING[table]),
+            unique_fields=self._get_unique_fields(table),
+            items=items,
+        )
+
+
+class AsyncPostgresUpsertSaver(BaseAsyncPostgresSaver):
+    """Saver which overwrites already loaded rows with the new values"""
+
+    async def save(self, table: str, items: list[Any]) -> None:
+        await self._perform_insert(
+            table=table,
+            stmt=BASE_UPSERT_STMT,
+            fields=self._get_dataclass_fields(DTO_TABLES_MAPPING[table]),
+            unique_fields=self._get_unique_fields(table),
+            items=items,
+        )
+
+
+class AsyncPostgresCopySaver(BaseAsyncPostgresSaver):
+    """Saver which streams chunks with COPY into a temporary staging
+    table of the connection and merges them into the target table
+    """
+
+    async def save(self, table: str, items: list[Any]) -> None:
+        fields = self._get_dataclass_fields(DTO_TABLES_MAPPING[table])
+        params = dict(
+            schema=DEFAULT_SCHEMA,
+            table=table,
+            staging=f"staging_{table}",
+            fields=", ".join(fields),
+            unique_fields=", ".join(self._get_unique_fields(table)),
+        )
+        buffer = io.BytesIO()
+        for item in items:
+            line = "\t".join(_to_copy_value(value) for value in _to_values(item, fields))
+            buffer.write(f"{line}\n".encode())
+        buffer.seek(0)
+        try:
+            await self._conn.execute(STAGING_TABLE_STMT.format(**params))
+            await self._conn.copy_to_table(
+                params["staging"], source=buffer, columns=fields, format="text"
+            )
+            await self._conn.execute(MERGE_STMT.format(**params))
+        except asyncpg.PostgresError as e:
+            logging.error(f"Error occurred while copying data: {e}")
+            raise e
+
+
+ASYNC_SAVERS = {
+    "insert": AsyncPostgresSaver,
+    "copy": AsyncPostgresCopySaver,
+    "upsert": AsyncPostgresUpsertSaver,
+    # executemany already pipelines all rows of the chunk in one round trip
+    "values": AsyncPostgresSaver,
+}
+
+
+class AsyncMultiStageETL(ConcreteETL):
+    """Loads all tables with asyncio over a pool of asyncpg connections
+
+    SQLite is read in a single executor thread, so the loop keeps
+    transforming and sending chunks while the next one is fetched. Up to
+    in_flight chunks are written concurrently, each in its own
+    transaction on a connection from the pool. A table is finished only
+    when all its chunks are written, so the related tables are loaded
+    after the primary ones, as in MultiStageETL.
+
+    With checkpoints the last id is stored only for a contiguous run of
+    written chunks, as chunks may complete out of order.
+    """
+
+    TABLES = MultiStageETL.TABLES
+
+    def __init__(self, sqlite_path: str, pg_dsl: dict) -> None:
+        super().__init__(sqlite_cur=None, pg_cur=None)
+        self._sqlite_path = sqlite_path
+        self._pg_dsl = pg_dsl
+        self._saver_class = AsyncPostgresSaver
+        self._pool_size = 4
+        self._in_flight = 8
+
+    def set_pool_size(self, pool_size: int) -> None:
+        self._pool_size = pool_size
+
+    def set_in_flight(self, in_flight: int) -> None:
+        self._in_flight = in_flight
+
+    def run(self) -> None:
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as executor, ExitStack() as stack:
+            # sqlite3 objects may only be used in the thread which created them
+            self._sqlite_cur = await loop.run_in_executor(
+                executor,
+                stack.enter_context,
+                connect_to_sqlite3(self._sqlite_path, read_only=True),
+            )
+            try:
+                async with asyncpg.create_pool(
+                    **_to_asyncpg_dsl(self._pg_dsl),
+                    min_size=self._pool_size,
+                    max_size=self._pool_size,
+                    init=_init_connection,
+                ) as pool:
+                    for table in self.TABLES:
+                        if self._references is not None and table in LINK_REFERENCES:
+                            await self._load_partial_tables(pool)
+                        await self._run_table(table, pool, executor)
+                    if self._references is not None:
+                        self._references.log_summary()
+            finally:
+                await loop.run_in_executor(executor, stack.close)
+
+    async def _run_table(
+        self, table: str, pool: asyncpg.Pool, executor: ThreadPoolExecutor
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        self._check_partial_load(table)
+        extractor = self._create_extractor(table)
+        if self._auto_chunk_size:
+            self._tuner = ChunkSizeTuner(table, self._chunk_size)
+            extractor.set_chunk_size(self._tuner.chunk_size)
+        stats = PipelineStats.create(table, queue_size=self._in_flight)
+        in_flight = asyncio.Semaphore(self._in_flight)
+        saved: dict[int, str] = {}
+        self._next_chunk = 0
+
+        started = time.perf_counter()
+        chunks = extractor.extract()
+        async with asyncio.TaskGroup() as tasks:
+            for index in count():
+                start = time.perf_counter()
+                rows = await loop.run_in_executor(executor, next, chunks, None)
+                self._track(stats, "extractor", start, rows)
+                if rows is None:
+                    break
+
+                start = time.perf_counter()
+                items = self._transform(table, extractor, rows)
+                self._track(stats, "transformer", start, rows)
+
+                await in_flight.acquire()
+                tasks.create_task(
+                    self._save_chunk_async(
+                        pool, in_flight, stats, saved, index, items, extractor
+                    )
+                )
+
+        if self._tuner is not None and not self._tuner.settled:
+            self._tuner.log_result()
+
+        if self._checkpoint is not None and self._pending_chunks:
+            self._checkpoint.set_state(checkpoint_key(table), self._last_id)
+            self._pending_chunks = 0
+
+        stats.elapsed = time.perf_counter() - started
+        logging.debug(stats.summary())
+        self.pipeline_stats.append(stats)
+        if self._modified_since is not None:
+            self.high_water_marks[table] = extractor.high_water
+
+    async def _save_chunk_async(
+        self,
+        pool: asyncpg.Pool,
+        in_flight: asyncio.Semaphore,
+        stats: PipelineStats,
+        saved: dict[int, str],
+        index: int,
+        items: list,
+        extractor: SQLiteMovieExtractor,
+    ) -> None:
+        table = stats.table
+        last_id = str(items[-1].id)
+        if self._references is not None and table in LINK_REFERENCES:
+            items = self._references.filter(table, items)
+        if not items:
+            # a chunk of orphans only moves the checkpoint
+            in_flight.release()
+        else:
+            try:
+                start = time.perf_counter()
+                async with pool.acquire() as conn, conn.transaction():
+                    await self._saver_class(conn).save(table, items)
+                self._track(stats, "saver", start, items)
+            finally:
+                in_flight.release()
+
+            if self._tuner is not None:
+                extractor.set_chunk_size(
+                    self._tuner.observe(len(items), time.perf_counter() - start)
+                )
+            if self._references is not None and table in PARENT_TABLES:
+                self._references.add(table, items)
+
+        if self._checkpoint is not None:
+            saved[index] = last_id
+            self._advance_checkpoint(table, saved)
+
+    async def _load_partial_tables(self, pool: asyncpg.Pool) -> None:
+        async with pool.acquire() as conn:
+            for table in self._references.partial_tables:
+                rows = await conn.fetch(IDS_SQL.format(schema=DEFAULT_SCHEMA, table=table))
+                self._references.add_ids(table, (row["id"] for row in rows))
+        # partial tables are complete now
+        self._references.clear_partial()
+
+    def _advance_checkpoint(self, table: str, saved: dict[int, str]) -> None:
+        while self._next_chunk in saved:
+            self._last_id = saved.pop(self._next_chunk)
+            self._next_chunk += 1
+            self._pending_chunks += 1
+            if self._pending_chunks >= self._checkpoint_every:
+                self._checkpoint.set_state(checkpoint_key(table), self._last_id)
+                self._pending_chunks = 0
+                logging.debug(f"Checkpoint for {table} at id {self._last_id}")
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    for type_name in TEXT_TYPES:
+        await conn.set_type_codec(
+            type_name, schema="pg_catalog", encoder=str, decoder=str, format="text"
+        )
+
+
+def _to_asyncpg_dsl(pg_dsl: dict) -> dict:
+    dsl = {
+        "database": pg_dsl.get("dbname"),
+        "user": pg_dsl.get("user"),
+        "password": pg_dsl.get("password"),
+        "host": pg_dsl.get("host"),
+        "port": int(pg_dsl["port"]) if pg_dsl.get("port") else None,
+    }
+    return {key: value for key, value in dsl.items() if value is not None}
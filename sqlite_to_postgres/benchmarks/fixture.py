@@ -0,0 +1,197 @@
+"""Synthetic SQLite database in the layout of the source movies DB
+
+    python -m benchmarks.fixture db.sqlite --scale 1000000
+
+Scale is the approximate total number of rows. For every film work the
+fixture holds one person, GENRES_PER_FILM genre links and
+PERSONS_PER_FILM person links, plus a small fixed set of genres.
+"""
+import argparse
+import random
+import sqlite3
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS film_work (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        creation_date DATE,
+        file_path TEXT,
+        rating FLOAT,
+        type TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS genre (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS person (
+        id TEXT PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS genre_film_work (
+        id TEXT PRIMARY KEY,
+        film_work_id TEXT NOT NULL,
+        genre_id TEXT NOT NULL,
+        created_at timestamp with time zone
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS film_work_genre ON genre_film_work (film_work_id, genre_id);
+    CREATE TABLE IF NOT EXISTS person_film_work (
+        id TEXT PRIMARY KEY,
+        film_work_id TEXT NOT NULL,
+        person_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        created_at timestamp with time zone
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS film_work_person_role ON person_film_work (film_work_id, person_id, role);
+"""
+
+GENRES = 50
+GENRES_PER_FILM = 2
+PERSONS_PER_FILM = 3
+ROWS_PER_FILM = 1 + 1 + GENRES_PER_FILM + PERSONS_PER_FILM
+ROLES = ("actor", "director", "writer")
+TYPES = ("movie", "tv_show")
+BATCH_SIZE = 10_000
+WORDS = (
+    "space", "love", "war", "star", "night", "city", "ghost", "king",
+    "dream", "road", "last", "first", "secret", "world", "time", "river",
+)
+
+
+def create_sqlite_fixture(path: str, scale: int, seed: int = 0) -> dict[str, int]:
+    """Create (or append to) a SQLite DB with roughly `scale` rows"""
+    conn = sqlite3.connect(path)
+    try:
+        counts = populate(conn, film_works=max(scale // ROWS_PER_FILM, 1), seed=seed)
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def populate(conn: sqlite3.Connection, film_works: int, seed: int = 0) -> dict[str, int]:
+    """Fill the source schema, rows are generated and written in batches,
+    so memory does not grow with the scale
+    """
+    rnd = random.Random(seed)
+    conn.executescript(SQLITE_SCHEMA)
+    base_time = datetime(2021, 6, 16, tzinfo=timezone.utc)
+
+    genre_ids = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(GENRES)]
+    _insert(
+        conn,
+        "INSERT INTO genre VALUES (?, ?, ?, ?, ?)",
+        (
+            (genre_id, f"Genre {i}", _text(rnd, 5), _ts(base_time, i), _ts(base_time, i))
+            for i, genre_id in enumerate(genre_ids)
+        ),
+    )
+
+    def film_works_rows() -> Iterator[tuple]:
+        for i in range(film_works):
+            created = _ts(base_time, i)
+            yield (
+                _film_work_id(i, seed),
+                _text(rnd, 3).title(),
+                _text(rnd, 30) if rnd.random() > 0.1 else None,
+                date(1950, 1, 1) + timedelta(days=rnd.randrange(27_000))
+                if rnd.random() > 0.2
+                else None,
+                "",
+                round(rnd.uniform(0, 10), 1) if rnd.random() > 0.1 else None,
+                rnd.choice(TYPES),
+                created,
+                created,
+            )
+
+    def persons_rows() -> Iterator[tuple]:
+        for i in range(film_works):
+            created = _ts(base_time, i)
+            yield (_person_id(i, seed), _text(rnd, 2).title(), created, created)
+
+    def genre_film_works_rows() -> Iterator[tuple]:
+        for i in range(film_works):
+            for genre_id in rnd.sample(genre_ids, GENRES_PER_FILM):
+                yield (
+                    str(uuid.UUID(int=rnd.getrandbits(128))),
+                    _film_work_id(i, seed),
+                    genre_id,
+                    _ts(base_time, i),
+                )
+
+    def person_film_works_rows() -> Iterator[tuple]:
+        for i in range(film_works):
+            for j in rnd.sample(range(film_works), min(PERSONS_PER_FILM, film_works)):
+                yield (
+                    str(uuid.UUID(int=rnd.getrandbits(128))),
+                    _film_work_id(i, seed),
+                    _person_id(j, seed),
+                    rnd.choice(ROLES),
+                    _ts(base_time, i),
+                )
+
+    return {
+        "genre": GENRES,
+        "film_work": _insert(
+            conn, "INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", film_works_rows()
+        ),
+        "person": _insert(conn, "INSERT INTO person VALUES (?, ?, ?, ?)", persons_rows()),
+        "genre_film_work": _insert(
+            conn, "INSERT INTO genre_film_work VALUES (?, ?, ?, ?)", genre_film_works_rows()
+        ),
+        "person_film_work": _insert(
+            conn, "INSERT INTO person_film_work VALUES (?, ?, ?, ?, ?)", person_film_works_rows()
+        ),
+    }
+
+
+def _insert(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple]) -> int:
+    rows = iter(rows)
+    total = 0
+    while batch := list(islice(rows, BATCH_SIZE)):
+        conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def _film_work_id(index: int, seed: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"film_work-{seed}-{index}"))
+
+
+def _person_id(index: int, seed: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"person-{seed}-{index}"))
+
+
+def _text(rnd: random.Random, words: int) -> str:
+    return " ".join(rnd.choices(WORDS, k=words))
+
+
+def _ts(base: datetime, offset: int) -> str:
+    return (base + timedelta(seconds=offset)).isoformat(sep=" ")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="SQLite file to create")
+    parser.add_argument("--scale", type=int, default=10_000, help="approximate total rows")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = create_sqlite_fixture(args.path, args.scale, args.seed)
+    for table, count in counts.items():
+        print(f"{table:<17} {count}")
+
+
+if __name__ == "__main__":
+    main()
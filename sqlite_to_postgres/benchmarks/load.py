@@ -0,0 +1,237 @@
+"""End-to-end benchmark of MultiStageETL against a local Postgres
+
+    python -m benchmarks.load --scale 100000 --truncate
+    python -m benchmarks.load --sqlite db.sqlite --saver copy --tuple-rows
+    python -m benchmarks.load --scale 100000 --compare insert values copy
+
+Target Postgres is taken from PG_DSL. Results are printed and written
+as JSON, so runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from psycopg2.extras import DictCursor
+
+from benchmarks.fixture import create_sqlite_fixture
+from config import CHUNK_SIZE, MEMORY_BUDGET, PG_DSL, QUEUE_SIZE, SAVER, VALUES_PAGE_SIZE
+from etl import MultiStageETL, RelationalSQLiteToPGETL, SQLiteToPGETL
+from extractor import connect_to_sqlite3
+from metrics import PeakMemoryHook
+from pipeline import PipelineStats, STAGES
+from saver import DEFAULT_SCHEMA, SAVERS, PostgresValuesSaver, connect_to_postgres
+
+ETL_STAGES = {
+    "primary": SQLiteToPGETL.TABLES,
+    "related": RelationalSQLiteToPGETL.TABLES,
+}
+
+
+def run_benchmark(sqlite_path: str, args: argparse.Namespace) -> dict:
+    if args.truncate:
+        truncate_tables()
+
+    memory = PeakMemoryHook()
+    started_at = datetime.now(timezone.utc).isoformat()
+    started = time.perf_counter()
+    with connect_to_sqlite3(sqlite_path) as sqlite_cur, connect_to_postgres(
+        PG_DSL, DictCursor
+    ) as pg_cur:
+        etl = MultiStageETL(sqlite_cur, pg_cur)
+        etl.set_chunk_size(args.chunk_size)
+        etl.set_saver(saver_class(args))
+        etl.set_tuple_rows(args.tuple_rows)
+        etl.set_memory_budget(args.memory_budget)
+        etl.add_hook(memory)
+        if args.pipelined:
+            etl.set_queue_size(QUEUE_SIZE)
+        etl.run()
+    elapsed = time.perf_counter() - started
+
+    tables = {
+        stats.table: _table_report(stats, memory) for stats in etl.pipeline_stats
+    }
+    rows = sum(table["rows"] for table in tables.values())
+    return {
+        "started_at": started_at,
+        "params": {
+            "sqlite": sqlite_path,
+            "scale": args.scale,
+            "chunk_size": args.chunk_size,
+            "saver": args.saver,
+            "page_size": args.page_size if args.saver == "values" else None,
+            "pipelined": args.pipelined,
+            "tuple_rows": args.tuple_rows,
+            "memory_budget": args.memory_budget,
+        },
+        "total": {
+            "rows": rows,
+            "seconds": elapsed,
+            "rows_per_sec": rows / elapsed if elapsed else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "stages": {
+            name: _stage_report([tables[table] for table in stage_tables if table in tables])
+            for name, stage_tables in ETL_STAGES.items()
+        },
+        "tables": tables,
+    }
+
+
+def compare_savers(sqlite_path: str, args: argparse.Namespace) -> dict:
+    runs = {}
+    for saver in args.compare:
+        runs[saver] = run_benchmark(
+            sqlite_path, argparse.Namespace(**{**vars(args), "saver": saver, "truncate": True})
+        )
+    return {
+        "comparison": {saver: report["total"] for saver, report in runs.items()},
+        "runs": runs,
+    }
+
+
+def saver_class(args: argparse.Namespace) -> type:
+    if args.saver == "values":
+        return partial(PostgresValuesSaver, page_size=args.page_size)
+    return SAVERS[args.saver]
+
+
+def truncate_tables() -> None:
+    with connect_to_postgres(PG_DSL, DictCursor) as pg_cur:
+        # CASCADE also empties the tables which reference the loaded ones,
+        # like the film work documents of the movies admin
+        pg_cur.execute(
+            f"TRUNCATE {', '.join(f'{DEFAULT_SCHEMA}.{table}' for table in MultiStageETL.TABLES)}"
+            " CASCADE"
+        )
+
+
+def _table_report(stats: PipelineStats, memory: PeakMemoryHook) -> dict:
+    return {
+        "rows": stats.rows,
+        "seconds": stats.elapsed,
+        "rows_per_sec": stats.rows / stats.elapsed if stats.elapsed else None,
+        "peak_rss_mb": memory.peak.get(stats.table, 0) / 2**20,
+        "rss_growth_mb": memory.growth(stats.table) / 2**20,
+        **{f"{stage}_seconds": stats.stages[stage].busy for stage in STAGES},
+    }
+
+
+def _stage_report(tables: list[dict]) -> dict:
+    rows = sum(table["rows"] for table in tables)
+    seconds = sum(table["seconds"] for table in tables)
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds else None,
+        **{
+            f"{stage}_seconds": sum(table[f"{stage}_seconds"] for table in tables)
+            for stage in STAGES
+        },
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def print_report(report: dict) -> None:
+    total = report["total"]
+    print(
+        f"total: {total['rows']} rows in {total['seconds']:.2f}s, "
+        f"{total['rows_per_sec']:.0f} rows/s, peak RSS {total['peak_rss_mb']:.1f} MB"
+    )
+    for section in ("stages", "tables"):
+        for name, item in report[section].items():
+            memory = ""
+            if "peak_rss_mb" in item:
+                memory = (
+                    f"  peak RSS {item['peak_rss_mb']:.1f} MB "
+                    f"(+{item['rss_growth_mb']:.1f} MB)"
+                )
+            print(
+                f"{name:<17} {item['rows']:>10} rows {item['seconds']:8.2f}s "
+                f"{item['rows_per_sec'] or 0:10.0f} rows/s  "
+                + "  ".join(f"{stage} {item[f'{stage}_seconds']:.2f}s" for stage in STAGES)
+                + memory
+            )
+
+
+def print_comparison(report: dict) -> None:
+    for saver, run in report["runs"].items():
+        print(f"--- {saver}")
+        print_report(run)
+    print("--- comparison")
+    baseline = None
+    for saver, total in report["comparison"].items():
+        baseline = baseline or total["rows_per_sec"]
+        print(
+            f"{saver:<8} {total['rows_per_sec']:10.0f} rows/s "
+            f"{total['rows_per_sec'] / baseline:6.2f}x  {total['seconds']:8.2f}s"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sqlite", help="existing SQLite DB to load")
+    source.add_argument("--scale", type=int, help="generate a synthetic DB of ~N rows")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--saver", choices=tuple(SAVERS), default=SAVER)
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=VALUES_PAGE_SIZE,
+        help="rows per INSERT of the values saver",
+    )
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--tuple-rows", action="store_true")
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=MEMORY_BUDGET,
+        help="approximate bytes per chunk, 0 sizes chunks by --chunk-size only",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        choices=tuple(SAVERS),
+        help="load the same data with each of the savers, truncating before every run",
+    )
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="truncate the target tables before loading",
+    )
+    parser.add_argument(
+        "--output",
+        default=f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json",
+        help="JSON file to write results to",
+    )
+    args = parser.parse_args()
+
+    run = compare_savers if args.compare else run_benchmark
+    if args.sqlite:
+        report = run(args.sqlite, args)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sqlite_path = os.path.join(tmp_dir, "fixture.sqlite")
+            create_sqlite_fixture(sqlite_path, args.scale)
+            report = run(sqlite_path, args)
+
+    if args.compare:
+        print_comparison(report)
+    else:
+        print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
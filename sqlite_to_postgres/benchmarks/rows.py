@@ -0,0 +1,82 @@
+"""Microbenchmark of the per-row cost of the dict/dataclass path
+against the tuple/record path, without Postgres
+
+    python -m benchmarks.rows --film-works 30000
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+from dataclasses import fields as dataclass_fields
+
+from benchmarks.fixture import populate
+from dto import DTO_TABLES_MAPPING
+from extractor import _dict_cursor_factory
+from transformer import SQLiteToPGRecordTransformer, SQLiteToPGTransformer
+
+
+def create_fixture(film_works: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    populate(conn, film_works)
+    return conn
+
+
+def dict_path(conn: sqlite3.Connection, table: str, chunk_size: int) -> int:
+    """Current path: dict rows -> dataclasses -> tuples for execute_batch"""
+    cur = conn.cursor()
+    cur.row_factory = _dict_cursor_factory
+    cur.execute(f"SELECT * FROM {table} ORDER BY id")
+    fields = tuple(field.name for field in dataclass_fields(DTO_TABLES_MAPPING[table]))
+    total = 0
+    while rows := cur.fetchmany(chunk_size):
+        items = SQLiteToPGTransformer(rows, table).transform()
+        data = [tuple(getattr(item, field) for field in fields) for item in items]
+        total += len(data)
+    return total
+
+
+def tuple_path(conn: sqlite3.Connection, table: str, chunk_size: int) -> int:
+    """Fast path: tuple rows -> records passed as is to execute_batch"""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(f"SELECT * FROM {table} ORDER BY id")
+    columns = tuple(column[0] for column in cur.description)
+    total = 0
+    while rows := cur.fetchmany(chunk_size):
+        data = SQLiteToPGRecordTransformer(rows, table, columns).transform()
+        total += len(data)
+    return total
+
+
+def measure_chunk_memory(path, conn: sqlite3.Connection, table: str, chunk_size: int) -> float:
+    """Peak traced bytes per row of a chunk in flight; chunks are released
+    between iterations, so the peak is bounded by a single chunk
+    """
+    tracemalloc.start()
+    path(conn, table, chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / chunk_size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--film-works", type=int, default=30_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    conn = create_fixture(args.film_works)
+    for table in ("film_work", "person_film_work"):
+        for name, path in (("dict", dict_path), ("tuple", tuple_path)):
+            start = time.process_time()
+            rows = path(conn, table, args.chunk_size)
+            cpu_per_row = (time.process_time() - start) / rows * 1e6
+            bytes_per_row = measure_chunk_memory(path, conn, table, args.chunk_size)
+            print(
+                f"{table:<17} {name:<6} {cpu_per_row:8.2f} us/row "
+                f"{bytes_per_row:8.0f} peak bytes/row"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,21 @@ PG_DSL = {
 SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH")
 
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+MEMORY_BUDGET = int(os.getenv("MEMORY_BUDGET", 0))
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", 4))
+PARTITIONS = int(os.getenv("PARTITIONS", 1))
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", 4))
+ASYNC_IN_FLIGHT = int(os.getenv("ASYNC_IN_FLIGHT", 8))
+
+SAVER = os.getenv("SAVER", "insert")
+VALUES_PAGE_SIZE = int(os.getenv("VALUES_PAGE_SIZE", 1000))
+
+STATE_FILE_PATH = os.getenv("STATE_FILE_PATH", "etl_state.json")
+CHECKPOINT_FILE_PATH = os.getenv("CHECKPOINT_FILE_PATH", "etl_checkpoint.json")
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", 10))
+
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE")
+REJECTS_FILE_PATH = os.getenv("REJECTS_FILE_PATH", "etl_rejects.jsonl")
 
 log_config = {
     "version":1,
@@ -0,0 +1,81 @@
+import logging
+import time
+
+from psycopg2.extensions import cursor as _cursor
+
+from saver import DEFAULT_SCHEMA
+
+REFRESH_BATCH_SIZE = 1000
+# the function is created by the migrations of the movies admin
+REFRESH_SQL = "SELECT {schema}.refresh_film_work_documents(%s::uuid[])"
+# film works changed since the marks of the previous incremental run,
+# the ETL keeps the timestamps of SQLite, so they are compared in Postgres
+CHANGED_FILM_WORKS_SQL = """
+    SELECT id FROM (
+        SELECT id FROM {schema}.film_work
+        WHERE modified >= coalesce(%(film_work)s::timestamptz, '-infinity')
+        UNION
+        SELECT film_work_id FROM {schema}.genre_film_work
+        WHERE created >= coalesce(%(genre_film_work)s::timestamptz, '-infinity')
+        UNION
+        SELECT film_work_id FROM {schema}.person_film_work
+        WHERE created >= coalesce(%(person_film_work)s::timestamptz, '-infinity')
+        UNION
+        SELECT gfw.film_work_id
+        FROM {schema}.genre_film_work gfw
+        JOIN {schema}.genre g ON g.id = gfw.genre_id
+        WHERE g.modified >= coalesce(%(genre)s::timestamptz, '-infinity')
+        UNION
+        SELECT pfw.film_work_id
+        FROM {schema}.person_film_work pfw
+        JOIN {schema}.person p ON p.id = pfw.person_id
+        WHERE p.modified >= coalesce(%(person)s::timestamptz, '-infinity')
+    ) changed
+    WHERE %(after)s::uuid IS NULL OR id > %(after)s::uuid
+    ORDER BY id
+    LIMIT %(limit)s
+"""
+ALL_FILM_WORKS_SQL = """
+    SELECT id FROM {schema}.film_work
+    WHERE %(after)s::uuid IS NULL OR id > %(after)s::uuid
+    ORDER BY id
+    LIMIT %(limit)s
+"""
+
+
+def refresh_documents(
+    pg_cur: _cursor,
+    modified_since: dict[str, str | None] | None = None,
+    batch_size: int = REFRESH_BATCH_SIZE,
+) -> int:
+    """Rebuild the film work documents read by the movies API
+
+    With modified_since only the film works whose rows, links, genres or
+    persons changed since those marks are refreshed, otherwise all of them.
+    Every batch is committed, so documents are not locked for the whole
+    refresh. Returns the number of documents which changed.
+    """
+    sql = ALL_FILM_WORKS_SQL
+    params = {}
+    if modified_since is not None:
+        sql = CHANGED_FILM_WORKS_SQL
+        params = dict(modified_since)
+
+    started = time.perf_counter()
+    refreshed, last_id = 0, None
+    while True:
+        pg_cur.execute(
+            sql.format(schema=DEFAULT_SCHEMA), {**params, "after": last_id, "limit": batch_size}
+        )
+        ids = [str(row[0]) for row in pg_cur.fetchall()]
+        if not ids:
+            break
+        pg_cur.execute(REFRESH_SQL.format(schema=DEFAULT_SCHEMA), (ids,))
+        refreshed += pg_cur.fetchone()[0]
+        pg_cur.connection.commit()
+        last_id = ids[-1]
+
+    logging.info(
+        f"{refreshed} film work documents refreshed in {time.perf_counter() - started:.1f} s"
+    )
+    return refreshed
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from typing import NamedTuple
 from uuid import UUID
 from datetime import datetime, date
 
@@ -50,6 +51,21 @@ class PersonFilmWork(UUIDMixin):
     created: datetime | None
 
 
+def _record_type(dataclass: type) -> type[tuple]:
+    """Build a positional tuple record with the same fields as the dataclass"""
+    return NamedTuple(
+        f"{dataclass.__name__}Record",
+        [(field.name, field.type) for field in fields(dataclass)],
+    )
+
+
+FilmWorkRecord = _record_type(FilmWork)
+PersonRecord = _record_type(Person)
+GenreRecord = _record_type(Genre)
+GenreFilmWorkRecord = _record_type(GenreFilmWork)
+PersonFilmWorkRecord = _record_type(PersonFilmWork)
+
+
 DTO_TABLES_MAPPING = {
     "film_work": FilmWork,
     "person": Person,
@@ -57,3 +73,11 @@ DTO_TABLES_MAPPING = {
     "genre_film_work": GenreFilmWork,
     "person_film_work": PersonFilmWork,
 }
+
+RECORD_TABLES_MAPPING = {
+    "film_work": FilmWorkRecord,
+    "person": PersonRecord,
+    "genre": GenreRecord,
+    "genre_film_work": GenreFilmWorkRecord,
+    "person_film_work": PersonFilmWorkRecord,
+}
@@ -1,12 +1,32 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Protocol
 
 import sqlite3
 
 from psycopg2.extensions import cursor as _cursor
+from psycopg2.extras import DictCursor
 
-from extractor import SQLiteMovieExtractor
-from transformer import SQLiteToPGTransformer
-from saver import PostgresSaver
+from extractor import SQLiteMovieExtractor, connect_to_sqlite3
+from metrics import ChunkEvent, ETLHook, payload_size
+from pipeline import ChunkPipeline, PipelineStats
+from transformer import SQLiteToPGRecordTransformer, SQLiteToPGTransformer
+from state import State
+from tuning import ChunkSizeTuner
+from validation import (
+    LINK_REFERENCES,
+    PARENT_TABLES,
+    ReferenceIndex,
+    load_partial_tables,
+)
+from saver import (
+    BasePostgresSaver,
+    PostgresSaver,
+    connect_to_postgres,
+    connect_to_postgres_pool,
+)
 
 
 class ETL(Protocol):
@@ -22,6 +42,33 @@ class ETL(Protocol):
     def set_chunk_size(self, chunk_size: int) -> None:
         ...
 
+    def set_saver(self, saver_class: type[BasePostgresSaver]) -> None:
+        ...
+
+    def set_queue_size(self, queue_size: int) -> None:
+        ...
+
+    def set_modified_since(self, modified_since: dict[str, str | None]) -> None:
+        ...
+
+    def set_checkpoint(self, checkpoint: State, every: int, resume: bool = False) -> None:
+        ...
+
+    def set_tuple_rows(self, tuple_rows: bool) -> None:
+        ...
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        ...
+
+    def set_auto_chunk_size(self, auto_chunk_size: bool) -> None:
+        ...
+
+    def set_reference_index(self, references: ReferenceIndex) -> None:
+        ...
+
+    def add_hook(self, hook: ETLHook) -> None:
+        ...
+
 
 class ConcreteETL(ETL):
 
@@ -31,6 +78,22 @@ class ConcreteETL(ETL):
         self._sqlite_cur = sqlite_cur
         self._pg_cur = pg_cur
         self._chunk_size = 1000
+        self._saver_class = PostgresSaver
+        self._queue_size = 0
+        self._modified_since: dict[str, str | None] | None = None
+        self._checkpoint: State | None = None
+        self._checkpoint_every = 0
+        self._resume = False
+        self._tuple_rows = False
+        self._memory_budget = 0
+        self._auto_chunk_size = False
+        self._references: ReferenceIndex | None = None
+        self._hooks: list[ETLHook] = []
+        self._pending_chunks = 0
+        self._last_id: str | None = None
+        self._tuner: ChunkSizeTuner | None = None
+        self.pipeline_stats: list[PipelineStats] = []
+        self.high_water_marks: dict[str, str | None] = {}
 
     def run(self) -> None:
         """Run ETL
@@ -41,18 +104,227 @@ class ConcreteETL(ETL):
 
         All data extracted and loaded in N sized rows chunks
         (N = chunk_size, default=1000)
+
+        If queue_size is set, steps 1-3 run concurrently and are joined
+        by bounded queues of that size
+
+        If modified_since is set, only rows modified since the given
+        per-table marks are extracted, and the new marks are collected
+        in high_water_marks
+
+        If checkpoint is set, the transaction is committed every N chunks
+        and the last loaded id of the table is stored in the checkpoint,
+        so an interrupted run can be resumed from that id
+
+        If tuple_rows is set, rows are kept as positional tuples from
+        SQLite to Postgres instead of dicts and dataclasses
+
+        If memory_budget is set, chunks are additionally limited to about
+        that many bytes, sized from the observed row width
+
+        If auto_chunk_size is set, chunk_size is only the starting point,
+        the size is tuned per table by the latency of the saver
+
+        If a reference index is set, ids of the saved film works, genres
+        and persons are collected in it, and link rows referencing unknown
+        ids are quarantined instead of being sent to Postgres
+
+        Added hooks are notified about every chunk processed by every
+        stage (extractor, transformer, saver)
         """
         for table in self.TABLES:
-            extractor = SQLiteMovieExtractor(self._sqlite_cur, table)
-            extractor.set_chunk_size(self._chunk_size)
+            self._check_partial_load(table)
+            extractor = self._create_extractor(table)
+            # one saver per table keeps its statements prepared for all chunks
+            saver = self._saver_class(self._pg_cur)
+            if self._auto_chunk_size:
+                self._tuner = ChunkSizeTuner(table, self._chunk_size)
+                extractor.set_chunk_size(self._tuner.chunk_size)
+
+            if self._queue_size:
+                self._run_pipelined(table, extractor, saver)
+            else:
+                self._run_serial(table, extractor, saver)
+
+            if self._tuner is not None and not self._tuner.settled:
+                self._tuner.log_result()
+
+            if self._pending_chunks:
+                self._commit_checkpoint(table)
+
+            if self._modified_since is not None:
+                self.high_water_marks[table] = extractor.high_water
+
+    def _check_partial_load(self, table: str) -> None:
+        if (
+            self._references is not None
+            and table in PARENT_TABLES
+            and self._loads_in_part(table)
+        ):
+            self._references.mark_partial(table)
+
+    def _loads_in_part(self, table: str) -> bool:
+        """Whether only some rows of the table pass through this ETL"""
+        if self._modified_since is not None:
+            return True
+        return bool(
+            self._checkpoint is not None
+            and self._resume
+            and self._checkpoint.get_state(checkpoint_key(table))
+        )
+
+    def _create_extractor(self, table: str) -> SQLiteMovieExtractor:
+        extractor = SQLiteMovieExtractor(self._sqlite_cur, table)
+        extractor.set_chunk_size(self._chunk_size)
+        extractor.set_tuple_rows(self._tuple_rows)
+        extractor.set_memory_budget(self._memory_budget)
+        if self._modified_since is not None:
+            extractor.set_modified_since(self._modified_since.get(table))
+        if self._checkpoint is not None and self._resume:
+            extractor.set_start_after(self._checkpoint.get_state(checkpoint_key(table)))
+        return extractor
+
+    def _run_serial(
+        self, table: str, extractor: SQLiteMovieExtractor, saver: BasePostgresSaver
+    ) -> None:
+        stats = PipelineStats.create(table, queue_size=0)
+        started = time.perf_counter()
+        chunks = extractor.extract()
+        while True:
+            start = time.perf_counter()
+            rows = next(chunks, None)
+            self._track(stats, "extractor", start, rows)
+            if rows is None:
+                break
+
+            start = time.perf_counter()
+            items = self._transform(table, extractor, rows)
+            self._track(stats, "transformer", start, rows)
+
+            start = time.perf_counter()
+            self._save_chunk(saver, table, items, extractor)
+            self._track(stats, "saver", start, items)
+
+        stats.elapsed = time.perf_counter() - started
+        logging.debug(stats.summary())
+        self.pipeline_stats.append(stats)
+
+    def _track(
+        self, stats: PipelineStats, stage: str, start: float, chunk: list | None
+    ) -> None:
+        seconds = time.perf_counter() - start
+        stage_stats = stats.stages[stage]
+        stage_stats.busy += seconds
+        if chunk is not None:
+            stage_stats.chunks += 1
+            stage_stats.rows += len(chunk)
+            self._notify(stats.table, stage, chunk, seconds)
+
+    def _notify(self, table: str, stage: str, chunk: list, seconds: float) -> None:
+        if not self._hooks:
+            return
+        event = ChunkEvent(
+            table=table,
+            stage=stage,
+            rows=len(chunk),
+            seconds=seconds,
+            bytes=payload_size(chunk) if stage == "saver" else 0,
+        )
+        for hook in self._hooks:
+            hook.on_chunk(event)
+
+    def _run_pipelined(
+        self, table: str, extractor: SQLiteMovieExtractor, saver: BasePostgresSaver
+    ) -> None:
+        pipeline = ChunkPipeline(
+            self._queue_size,
+            on_chunk=lambda stage, chunk, seconds: self._notify(table, stage, chunk, seconds),
+        )
+        stats = pipeline.run(
+            table,
+            chunks=extractor.extract(),
+            transform=lambda rows: self._transform(table, extractor, rows),
+            save=lambda items: self._save_chunk(saver, table, items, extractor),
+        )
+        self.pipeline_stats.append(stats)
+
+    def _transform(
+        self, table: str, extractor: SQLiteMovieExtractor, rows: list
+    ) -> list:
+        if self._tuple_rows:
+            return SQLiteToPGRecordTransformer(rows, table, extractor.columns).transform()
+        return SQLiteToPGTransformer(rows, table).transform()
+
+    def _save_chunk(
+        self,
+        saver: BasePostgresSaver,
+        table: str,
+        items: list,
+        extractor: SQLiteMovieExtractor,
+    ) -> None:
+        if not items:
+            return
+        last_id = str(items[-1].id)
+        if self._references is not None and table in LINK_REFERENCES:
+            items = self._references.filter(table, items)
 
-            for rows in extractor.extract():
-                transformer = SQLiteToPGTransformer(rows, table)
-                saver = PostgresSaver(self._pg_cur)
-                saver.save(table, transformer.transform())
+        # a chunk of orphans only moves the checkpoint
+        if items:
+            start = time.perf_counter()
+            saver.save(table, items)
+            if self._tuner is not None:
+                # in the pipelined mode the new size applies to the chunks
+                # which are not extracted yet
+                extractor.set_chunk_size(
+                    self._tuner.observe(len(items), time.perf_counter() - start)
+                )
+            if self._references is not None and table in PARENT_TABLES:
+                self._references.add(table, items)
+        if self._checkpoint is None:
+            return
+
+        self._pending_chunks += 1
+        self._last_id = last_id
+        if self._pending_chunks >= self._checkpoint_every:
+            self._commit_checkpoint(table)
+
+    def _commit_checkpoint(self, table: str) -> None:
+        self._pg_cur.connection.commit()
+        self._checkpoint.set_state(checkpoint_key(table), self._last_id)
+        self._pending_chunks = 0
+        logging.debug(f"Checkpoint for {table} at id {self._last_id}")
     
     def set_chunk_size(self, chunk_size: int) -> None:
         self._chunk_size = chunk_size
+
+    def set_saver(self, saver_class: type[BasePostgresSaver]) -> None:
+        self._saver_class = saver_class
+
+    def set_queue_size(self, queue_size: int) -> None:
+        self._queue_size = queue_size
+
+    def set_modified_since(self, modified_since: dict[str, str | None]) -> None:
+        self._modified_since = modified_since
+
+    def set_checkpoint(self, checkpoint: State, every: int, resume: bool = False) -> None:
+        self._checkpoint = checkpoint
+        self._checkpoint_every = every
+        self._resume = resume
+
+    def set_tuple_rows(self, tuple_rows: bool) -> None:
+        self._tuple_rows = tuple_rows
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        self._memory_budget = memory_budget
+
+    def set_auto_chunk_size(self, auto_chunk_size: bool) -> None:
+        self._auto_chunk_size = auto_chunk_size
+
+    def set_reference_index(self, references: ReferenceIndex) -> None:
+        self._references = references
+
+    def add_hook(self, hook: ETLHook) -> None:
+        self._hooks.append(hook)
   
 
 
@@ -64,12 +336,45 @@ class RelationalSQLiteToPGETL(ConcreteETL):
     TABLES = ("genre_film_work", "person_film_work")
 
 
+class TableETL(ConcreteETL):
+    def __init__(self, sqlite_cur: sqlite3.Cursor, pg_cur: _cursor, table: str) -> None:
+        super().__init__(sqlite_cur, pg_cur)
+        self.TABLES = (table,)
+        self._id_range: tuple[str | None, str | None] = (None, None)
+
+    def set_id_range(self, lower: str | None, upper: str | None) -> None:
+        self._id_range = (lower, upper)
+
+    def _loads_in_part(self, table: str) -> bool:
+        return self._id_range != (None, None) or super()._loads_in_part(table)
+
+    def _create_extractor(self, table: str) -> SQLiteMovieExtractor:
+        extractor = super()._create_extractor(table)
+        extractor.set_id_range(*self._id_range)
+        return extractor
+
+
 class MultiStageETL(ETL):
 
+    TABLES = SQLiteToPGETL.TABLES + RelationalSQLiteToPGETL.TABLES
+
     def __init__(self, sqlite_cur: sqlite3.Cursor, pg_cur: _cursor) -> None:
         self._sqlite_cur = sqlite_cur
         self._pg_cur = pg_cur
         self._chunk_size = 1000
+        self._saver_class = PostgresSaver
+        self._queue_size = 0
+        self._modified_since: dict[str, str | None] | None = None
+        self._checkpoint: State | None = None
+        self._checkpoint_every = 0
+        self._resume = False
+        self._tuple_rows = False
+        self._memory_budget = 0
+        self._auto_chunk_size = False
+        self._references: ReferenceIndex | None = None
+        self._hooks: list[ETLHook] = []
+        self.pipeline_stats: list[PipelineStats] = []
+        self.high_water_marks: dict[str, str | None] = {}
 
     def run(self) -> None:
         """Run multiple ETLs
@@ -82,22 +387,208 @@ class MultiStageETL(ETL):
         (N = chunk_size, default=1000)
         """
         self._run_etl_for_primary_tables(sqlite_cur=self._sqlite_cur, pg_cur=self._pg_cur)
+        if self._references is not None:
+            load_partial_tables(self._references, self._pg_cur)
         self._run_etl_for_related_tables(sqlite_cur=self._sqlite_cur, pg_cur=self._pg_cur)
+        if self._references is not None:
+            self._references.log_summary()
     
     def set_chunk_size(self, chunk_size: int) -> None:
         self._chunk_size = chunk_size
 
+    def set_saver(self, saver_class: type[BasePostgresSaver]) -> None:
+        self._saver_class = saver_class
+
+    def set_queue_size(self, queue_size: int) -> None:
+        self._queue_size = queue_size
+
+    def set_modified_since(self, modified_since: dict[str, str | None]) -> None:
+        self._modified_since = modified_since
+
+    def set_checkpoint(self, checkpoint: State, every: int, resume: bool = False) -> None:
+        self._checkpoint = checkpoint
+        self._checkpoint_every = every
+        self._resume = resume
+
+    def set_tuple_rows(self, tuple_rows: bool) -> None:
+        self._tuple_rows = tuple_rows
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        self._memory_budget = memory_budget
+
+    def set_auto_chunk_size(self, auto_chunk_size: bool) -> None:
+        self._auto_chunk_size = auto_chunk_size
+
+    def set_reference_index(self, references: ReferenceIndex) -> None:
+        self._references = references
+
+    def add_hook(self, hook: ETLHook) -> None:
+        self._hooks.append(hook)
+
     def _run_etl_for_primary_tables(
         self, sqlite_cur: sqlite3.Cursor, pg_cur: _cursor
     ) -> None:
         etl = SQLiteToPGETL(sqlite_cur, pg_cur)
-        etl.set_chunk_size(self._chunk_size)
+        self._configure(etl)
         etl.run()
+        self.pipeline_stats.extend(etl.pipeline_stats)
+        self.high_water_marks.update(etl.high_water_marks)
 
 
     def _run_etl_for_related_tables(
         self, sqlite_cur: sqlite3.Cursor, pg_cur: _cursor
     ) -> None:
         etl = RelationalSQLiteToPGETL(sqlite_cur, pg_cur)
+        self._configure(etl)
+        etl.run()
+        self.pipeline_stats.extend(etl.pipeline_stats)
+        self.high_water_marks.update(etl.high_water_marks)
+
+    def _configure(self, etl: ConcreteETL) -> None:
         etl.set_chunk_size(self._chunk_size)
+        etl.set_saver(self._saver_class)
+        etl.set_queue_size(self._queue_size)
+        etl.set_tuple_rows(self._tuple_rows)
+        etl.set_memory_budget(self._memory_budget)
+        etl.set_auto_chunk_size(self._auto_chunk_size)
+        if self._references is not None:
+            etl.set_reference_index(self._references)
+        for hook in self._hooks:
+            etl.add_hook(hook)
+        if self._modified_since is not None:
+            etl.set_modified_since(self._modified_since)
+        if self._checkpoint is not None:
+            etl.set_checkpoint(self._checkpoint, self._checkpoint_every, self._resume)
+
+
+def checkpoint_key(table: str) -> str:
+    return f"{table}.last_id"
+
+
+class ParallelMultiStageETL(MultiStageETL):
+    """Loads every table of a stage concurrently
+
+    Each table gets its own SQLite connection and its own Postgres
+    connection from a pool. All connections of a stage are committed
+    before the next stage starts, so foreign keys of the related
+    tables hold.
+
+    With partitions > 1 large tables are additionally split into keyset
+    ranges, each loaded by a separate worker process with its own
+    read-only SQLite connection and Postgres connection. Partitioned
+    tables are not checkpointed and are not reported to hooks.
+    """
+
+    STAGES = (SQLiteToPGETL.TABLES, RelationalSQLiteToPGETL.TABLES)
+
+    def __init__(self, sqlite_path: str, pg_dsl: dict) -> None:
+        super().__init__(sqlite_cur=None, pg_cur=None)
+        self._sqlite_path = sqlite_path
+        self._pg_dsl = pg_dsl
+        self._partitions = 1
+
+    def set_partitions(self, partitions: int) -> None:
+        self._partitions = partitions
+
+    def run(self) -> None:
+        for tables in self.STAGES:
+            if self._references is not None and tables == RelationalSQLiteToPGETL.TABLES:
+                with connect_to_postgres(self._pg_dsl, DictCursor) as pg_cur:
+                    load_partial_tables(self._references, pg_cur)
+            self._run_stage(tables)
+        if self._references is not None:
+            self._references.log_summary()
+
+    def _run_stage(self, tables: tuple[str, ...]) -> None:
+        with connect_to_postgres_pool(
+            self._pg_dsl, DictCursor, size=len(tables)
+        ) as pg_curs, ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            futures = [
+                executor.submit(self._run_table, table, pg_cur)
+                for table, pg_cur in zip(tables, pg_curs)
+            ]
+            for future in futures:
+                future.result()
+        logging.debug(f"Stage {tables} committed")
+
+    def _run_table(self, table: str, pg_cur: _cursor) -> None:
+        with connect_to_sqlite3(self._sqlite_path) as sqlite_cur:
+            # link rows are validated in this process, against its reference index
+            partitions = self._partitions
+            if self._references is not None and table in LINK_REFERENCES:
+                partitions = 1
+            id_ranges = SQLiteMovieExtractor(sqlite_cur, table).get_id_ranges(
+                partitions, min_rows=self._chunk_size
+            )
+            if len(id_ranges) == 1:
+                etl = TableETL(sqlite_cur, pg_cur, table)
+                self._configure(etl)
+                etl.run()
+                self.pipeline_stats.extend(etl.pipeline_stats)
+                self.high_water_marks.update(etl.high_water_marks)
+                return
+
+        logging.debug(f"Loading {table} in {len(id_ranges)} partitions")
+        if self._references is not None:
+            self._references.mark_partial(table)
+        if self._checkpoint is not None:
+            logging.warning(f"Checkpoints are not used for partitioned table {table}")
+        with ProcessPoolExecutor(
+            max_workers=len(id_ranges), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _load_partition,
+                    self._sqlite_path,
+                    self._pg_dsl,
+                    table,
+                    id_range,
+                    self._chunk_size,
+                    self._saver_class,
+                    self._queue_size,
+                    self._modified_since,
+                    self._tuple_rows,
+                    self._memory_budget,
+                    self._auto_chunk_size,
+                )
+                for id_range in id_ranges
+            ]
+            marks = []
+            for future in futures:
+                pipeline_stats, high_water_marks = future.result()
+                self.pipeline_stats.extend(pipeline_stats)
+                marks.append(high_water_marks.get(table))
+
+        if self._modified_since is not None:
+            self.high_water_marks[table] = max(filter(None, marks), default=None)
+
+
+def _load_partition(
+    sqlite_path: str,
+    pg_dsl: dict,
+    table: str,
+    id_range: tuple[str | None, str | None],
+    chunk_size: int,
+    saver_class: type[BasePostgresSaver],
+    queue_size: int,
+    modified_since: dict[str, str | None] | None,
+    tuple_rows: bool,
+    memory_budget: int,
+    auto_chunk_size: bool,
+) -> tuple[list[PipelineStats], dict[str, str | None]]:
+    """Worker process entrypoint: load one keyset range of a table"""
+    with connect_to_sqlite3(
+        sqlite_path, read_only=True
+    ) as sqlite_cur, connect_to_postgres(pg_dsl, DictCursor) as pg_cur:
+        etl = TableETL(sqlite_cur, pg_cur, table)
+        etl.set_chunk_size(chunk_size)
+        etl.set_saver(saver_class)
+        etl.set_queue_size(queue_size)
+        etl.set_id_range(*id_range)
+        etl.set_tuple_rows(tuple_rows)
+        etl.set_memory_budget(memory_budget)
+        etl.set_auto_chunk_size(auto_chunk_size)
+        if modified_since is not None:
+            etl.set_modified_since(modified_since)
         etl.run()
+    return etl.pipeline_stats, etl.high_water_marks
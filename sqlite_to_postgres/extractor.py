@@ -1,4 +1,5 @@
 import logging
+import sys
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
 from sqlite3 import Cursor, connect, Error
@@ -6,6 +7,19 @@ from dataclasses import fields as dataclass_fields
 from typing import Any, Generator
 from config import CHUNK_SIZE
 
+# the budget has to hold a chunk several times at once: as SQLite rows,
+# as DTOs and as the values passed to the driver
+CHUNK_COPIES = 3
+PROBE_ROWS = 100
+
+MODIFIED_COLUMNS = {
+    "film_work": "updated_at",
+    "genre": "updated_at",
+    "person": "updated_at",
+    "genre_film_work": "created_at",
+    "person_film_work": "created_at",
+}
+
 
 class BaseSQLiteExtractor(ABC):
     def __init__(self, cursor: Cursor, table: str) -> None:
@@ -31,30 +45,176 @@ class SQLiteMovieExtractor(BaseSQLiteExtractor):
             *
         FROM
             {table_name}
+        {where}
         ORDER BY
             id
         """
+    COUNT_SQL = "SELECT COUNT(*) AS count FROM {table_name} {where}"
+    ID_AT_OFFSET_SQL = "SELECT id FROM {table_name} {where} ORDER BY id LIMIT 1 OFFSET ?"
+
+    def __init__(self, cursor: Cursor, table: str) -> None:
+        super().__init__(cursor, table)
+        self._id_range: tuple[str | None, str | None] = (None, None)
+        self._start_after: str | None = None
+        self._track_modified = False
+        self._modified_since: str | None = None
+        self._tuple_rows = False
+        self._memory_budget = 0
+        self._row_width = 0.0
+        self.high_water: str | None = None
+        self.columns: tuple[str, ...] = ()
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        """Limit the memory held by one chunk to about `memory_budget` bytes
+
+        The chunk size (at most chunk_size rows) is recalculated after every
+        fetch from the average row width seen so far, 0 disables the limit.
+        """
+        self._memory_budget = memory_budget
+
+    def set_tuple_rows(self, tuple_rows: bool) -> None:
+        """Yield rows as plain tuples in the order of `columns` instead of
+        dicts built by the connection's row factory
+        """
+        self._tuple_rows = tuple_rows
+
+    def set_modified_since(self, modified_since: str | None) -> None:
+        """Extract only rows modified at or after `modified_since`
+        (None means all rows) and track the latest modification seen
+        in `high_water`
+        """
+        self._track_modified = True
+        self._modified_since = modified_since
+        self.high_water = modified_since
+
+    def set_start_after(self, last_id: str | None) -> None:
+        """Resume extraction after the given id, None means from the start"""
+        self._start_after = last_id
+
+    def set_id_range(self, lower: str | None, upper: str | None) -> None:
+        """Limit extraction to ids in [lower, upper), None means unbounded"""
+        self._id_range = (lower, upper)
+
+    def get_id_ranges(
+        self, partitions: int, min_rows: int = 0
+    ) -> list[tuple[str | None, str | None]]:
+        """Split the table (or its id range, if set) into at most
+        `partitions` keyset ranges
+
+        Boundaries are sampled at evenly spaced offsets of the id index, so
+        ranges hold roughly the same number of rows. Tables with fewer than
+        `min_rows` rows per partition are not split.
+        """
+        conditions, params = self._id_range_conditions()
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            count = self.count()
+            partitions = max(1, min(partitions, count // max(min_rows, 1)))
+
+            boundaries = []
+            sql = self.ID_AT_OFFSET_SQL.format(table_name=self._table, where=where)
+            for partition in range(1, partitions):
+                self._cur.execute(sql, (*params, count * partition // partitions))
+                boundary = self._cur.fetchone()["id"]
+                if not boundaries or boundaries[-1] != boundary:
+                    boundaries.append(boundary)
+        except Error as e:
+            logging.error(f"Error occurred while sampling id boundaries: {e}")
+            raise e
+
+        bounds = [self._id_range[0], *boundaries, self._id_range[1]]
+        return list(zip(bounds[:-1], bounds[1:]))
 
-    def extract(self) -> Generator[list[dict], None, None]:
-        sql = self.BASE_SQL.format(table_name=self._table)
+    def count(self) -> int:
+        """Number of rows in the id range"""
+        conditions, params = self._id_range_conditions()
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            self._cur.execute(self.COUNT_SQL.format(table_name=self._table, where=where), params)
+        except Error as e:
+            logging.error(f"Error occurred while counting rows: {e}")
+            raise e
+        return self._cur.fetchone()["count"]
+
+    def _id_range_conditions(self) -> tuple[list[str], list[str]]:
+        lower, upper = self._id_range
+        conditions, params = [], []
+        if lower is not None:
+            conditions.append("id >= ?")
+            params.append(lower)
+        if upper is not None:
+            conditions.append("id < ?")
+            params.append(upper)
+        return conditions, params
+
+    def extract(self) -> Generator[list[dict] | list[tuple], None, None]:
+        conditions, params = self._id_range_conditions()
+        if self._start_after is not None:
+            conditions.append("id > ?")
+            params.append(self._start_after)
+        if self._modified_since is not None:
+            conditions.append(f"{MODIFIED_COLUMNS[self._table]} >= ?")
+            params.append(self._modified_since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        sql = self.BASE_SQL.format(table_name=self._table, where=where)
+        cur = self._cur
+        if self._tuple_rows:
+            cur = self._cur.connection.cursor()
+            cur.row_factory = None
         try:
-            self._cur.execute(sql)
+            cur.execute(sql, params)
         except Error as e:
             logging.error(f"Error occurred while extracting data: {e}")
             raise e
+        self.columns = tuple(column[0] for column in cur.description)
 
+        fitted = PROBE_ROWS if self._memory_budget else None
         while True:
-            rows = self._cur.fetchmany(size=self._chunk_size)
+            # chunk_size may be changed between chunks, e.g. by a tuner
+            size = self._chunk_size if fitted is None else min(fitted, self._chunk_size)
+            rows = cur.fetchmany(size=size)
 
             if not rows:
                 return
 
+            if self._memory_budget:
+                fitted = self._fit_chunk_size(rows, size)
+
+            if self._track_modified:
+                self._update_high_water(rows)
+
             yield rows
 
+    def _fit_chunk_size(self, rows: list[dict] | list[tuple], size: int) -> int:
+        width = sum(_row_size(row) for row in rows) / len(rows)
+        # wider rows are taken into account at once, narrower ones only
+        # halve the gap, so the chunk grows back gradually
+        self._row_width = max(width, (self._row_width + width) / 2)
+        fitted = int(self._memory_budget // (self._row_width * CHUNK_COPIES))
+        fitted = max(1, fitted)
+        if fitted != size and fitted < self._chunk_size:
+            logging.debug(
+                f"{self._table}: {self._row_width:.0f} bytes per row, "
+                f"chunk resized to {fitted} rows"
+            )
+        return fitted
+
+    def _update_high_water(self, rows: list[dict] | list[tuple]) -> None:
+        column = MODIFIED_COLUMNS[self._table]
+        if self._tuple_rows:
+            column = self.columns.index(column)
+        modified = [row[column] for row in rows if row[column] is not None]
+        if modified:
+            self.high_water = max(self.high_water or "", *modified)
+
 
 @contextmanager
-def connect_to_sqlite3(file_name: str):
-    conn = connect(file_name)
+def connect_to_sqlite3(file_name: str, read_only: bool = False):
+    if read_only:
+        conn = connect(f"file:{file_name}?mode=ro", uri=True)
+    else:
+        conn = connect(file_name)
     conn.row_factory = _dict_cursor_factory
     try:
         logging.debug("Creating connection")
@@ -65,6 +225,11 @@ def connect_to_sqlite3(file_name: str):
         conn.close()
 
 
+def _row_size(row: dict | tuple) -> int:
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+
+
 def _dict_cursor_factory(cursor: Cursor, row: list) -> dict:
     data = {}
     for index, column in enumerate(cursor.description):
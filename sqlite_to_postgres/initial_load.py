@@ -0,0 +1,201 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import psycopg2
+from psycopg2.extensions import cursor as _cursor
+from psycopg2.extras import DictCursor
+
+from saver import DEFAULT_SCHEMA, connect_to_postgres
+from state import State
+
+INDEXES_KEY = "initial_load.indexes"
+FOREIGN_KEYS_KEY = "initial_load.foreign_keys"
+
+IS_EMPTY_SQL = "SELECT NOT EXISTS (SELECT 1 FROM {schema}.{table})"
+SECONDARY_INDEXES_SQL = """
+    SELECT
+        t.relname AS table_name,
+        i.relname AS name,
+        pg_get_indexdef(ix.indexrelid) AS definition,
+        ix.indisunique AS is_unique,
+        c.conname AS constraint_name,
+        array_agg(a.attname::text ORDER BY k.n) AS columns
+    FROM pg_index ix
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_namespace ns ON ns.oid = t.relnamespace
+    CROSS JOIN LATERAL unnest(ix.indkey) WITH ORDINALITY AS k(attnum, n)
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+    LEFT JOIN pg_constraint c ON c.conindid = ix.indexrelid AND c.contype = 'u'
+    WHERE ns.nspname = %s AND t.relname = ANY(%s) AND NOT ix.indisprimary
+    GROUP BY t.relname, i.relname, ix.indexrelid, ix.indisunique, c.conname
+"""
+FOREIGN_KEYS_SQL = """
+    SELECT
+        t.relname AS table_name,
+        c.conname AS name,
+        pg_get_constraintdef(c.oid) AS definition
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    JOIN pg_namespace ns ON ns.oid = t.relnamespace
+    WHERE ns.nspname = %s AND t.relname = ANY(%s) AND c.contype = 'f'
+"""
+CONSTRAINT_EXISTS_SQL = """
+    SELECT EXISTS (
+        SELECT 1
+        FROM pg_constraint c
+        JOIN pg_namespace ns ON ns.oid = c.connamespace
+        WHERE ns.nspname = %s AND c.conname = %s
+    )
+"""
+DEDUPLICATE_SQL = """
+    DELETE FROM {schema}.{table} a
+    USING {schema}.{table} b
+    WHERE {condition} AND a.id > b.id
+"""
+
+
+class InitialLoad:
+    """Defers secondary indexes and foreign keys during the first load
+
+    On empty target tables every INSERT would otherwise maintain the
+    secondary indexes and check the foreign keys row by row. They are
+    dropped before the load and their definitions are kept in the state,
+    so an interrupted load can still restore them. After the load
+    duplicates of the unique keys are removed (the row with the smallest
+    id wins, as with ON CONFLICT DO NOTHING in id order), indexes are
+    rebuilt in parallel and foreign keys are validated once.
+    """
+
+    def __init__(self, tables: tuple[str, ...], state: State) -> None:
+        self._tables = tables
+        self._state = state
+
+    @property
+    def pending(self) -> bool:
+        return bool(
+            self._state.get_state(INDEXES_KEY) or self._state.get_state(FOREIGN_KEYS_KEY)
+        )
+
+    def prepare(self, pg_cur: _cursor) -> bool:
+        """Drop secondary indexes and foreign keys if all tables are empty
+
+        Returns True if the load runs without them.
+        """
+        if self.pending:
+            logging.info("Continuing an unfinished initial load")
+            return True
+        if not self._targets_are_empty(pg_cur):
+            logging.info("Target tables are not empty, indexes are kept")
+            return False
+
+        pg_cur.execute(SECONDARY_INDEXES_SQL, (DEFAULT_SCHEMA, list(self._tables)))
+        indexes = [dict(row) for row in pg_cur.fetchall()]
+        pg_cur.execute(FOREIGN_KEYS_SQL, (DEFAULT_SCHEMA, list(self._tables)))
+        foreign_keys = [dict(row) for row in pg_cur.fetchall()]
+
+        # definitions are stored before anything is dropped
+        self._state.set_state(INDEXES_KEY, indexes)
+        self._state.set_state(FOREIGN_KEYS_KEY, foreign_keys)
+
+        for fk in foreign_keys:
+            pg_cur.execute(
+                f"ALTER TABLE {DEFAULT_SCHEMA}.{fk['table_name']} "
+                f"DROP CONSTRAINT {fk['name']}"
+            )
+        for index in indexes:
+            if index["constraint_name"]:
+                pg_cur.execute(
+                    f"ALTER TABLE {DEFAULT_SCHEMA}.{index['table_name']} "
+                    f"DROP CONSTRAINT {index['constraint_name']}"
+                )
+            else:
+                pg_cur.execute(f"DROP INDEX {DEFAULT_SCHEMA}.{index['name']}")
+        pg_cur.connection.commit()
+        logging.info(
+            f"Dropped {len(indexes)} indexes and {len(foreign_keys)} foreign keys "
+            "for the initial load"
+        )
+        return True
+
+    def finish(self, pg_dsl: dict) -> None:
+        """Deduplicate, rebuild indexes in parallel and validate foreign keys"""
+        indexes = self._state.get_state(INDEXES_KEY) or []
+        foreign_keys = self._state.get_state(FOREIGN_KEYS_KEY) or []
+
+        with connect_to_postgres(pg_dsl, DictCursor) as pg_cur:
+            for index in indexes:
+                if index["is_unique"]:
+                    self._deduplicate(pg_cur, index["table_name"], index["columns"])
+
+        if indexes:
+            with ThreadPoolExecutor(max_workers=len(indexes)) as executor:
+                futures = [
+                    executor.submit(self._restore_index, pg_dsl, index) for index in indexes
+                ]
+                for future in futures:
+                    future.result()
+        self._state.set_state(INDEXES_KEY, None)
+
+        with connect_to_postgres(pg_dsl, DictCursor) as pg_cur:
+            for fk in foreign_keys:
+                self._restore_foreign_key(pg_cur, fk)
+        self._state.set_state(FOREIGN_KEYS_KEY, None)
+        logging.info("Initial load finished, indexes and foreign keys restored")
+
+    def _targets_are_empty(self, pg_cur: _cursor) -> bool:
+        for table in self._tables:
+            pg_cur.execute(IS_EMPTY_SQL.format(schema=DEFAULT_SCHEMA, table=table))
+            if not pg_cur.fetchone()[0]:
+                return False
+        return True
+
+    def _deduplicate(self, pg_cur: _cursor, table: str, columns: list[str]) -> None:
+        condition = " AND ".join(f"a.{column} = b.{column}" for column in columns)
+        pg_cur.execute(
+            DEDUPLICATE_SQL.format(schema=DEFAULT_SCHEMA, table=table, condition=condition)
+        )
+        if pg_cur.rowcount:
+            logging.warning(f"Removed {pg_cur.rowcount} duplicates of {columns} from {table}")
+
+    def _restore_index(self, pg_dsl: dict, index: dict[str, Any]) -> None:
+        with connect_to_postgres(pg_dsl, DictCursor) as pg_cur:
+            try:
+                pg_cur.execute(_if_not_exists(index["definition"]))
+                if index["constraint_name"] and not _constraint_exists(
+                    pg_cur, index["constraint_name"]
+                ):
+                    pg_cur.execute(
+                        f"ALTER TABLE {DEFAULT_SCHEMA}.{index['table_name']} "
+                        f"ADD CONSTRAINT {index['constraint_name']} "
+                        f"UNIQUE USING INDEX {index['name']}"
+                    )
+            except psycopg2.Error as e:
+                logging.error(f"Error occurred while restoring index {index['name']}: {e}")
+                raise e
+        logging.debug(f"Restored index {index['name']}")
+
+    def _restore_foreign_key(self, pg_cur: _cursor, fk: dict[str, Any]) -> None:
+        table = f"{DEFAULT_SCHEMA}.{fk['table_name']}"
+        try:
+            if not _constraint_exists(pg_cur, fk["name"]):
+                pg_cur.execute(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {fk['name']} "
+                    f"{fk['definition']} NOT VALID"
+                )
+            pg_cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {fk['name']}")
+        except psycopg2.Error as e:
+            logging.error(f"Error occurred while validating foreign key {fk['name']}: {e}")
+            raise e
+        pg_cur.connection.commit()
+
+
+def _constraint_exists(pg_cur: _cursor, name: str) -> bool:
+    pg_cur.execute(CONSTRAINT_EXISTS_SQL, (DEFAULT_SCHEMA, name))
+    return pg_cur.fetchone()[0]
+
+
+def _if_not_exists(index_definition: str) -> str:
+    """Make a pg_get_indexdef statement safe to rerun after a crash"""
+    return index_definition.replace(" INDEX ", " INDEX IF NOT EXISTS ", 1)
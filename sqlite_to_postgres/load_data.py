@@ -1,23 +1,407 @@
+import argparse
 import sqlite3
 
 from psycopg2.extensions import cursor as _cursor
 from psycopg2.extras import DictCursor
 
-from config import PG_DSL, SQLITE_DB_PATH, CHUNK_SIZE
-from etl import MultiStageETL
+from config import (
+    PG_DSL,
+    SQLITE_DB_PATH,
+    CHUNK_SIZE,
+    MEMORY_BUDGET,
+    QUEUE_SIZE,
+    PARTITIONS,
+    ASYNC_POOL_SIZE,
+    ASYNC_IN_FLIGHT,
+    SAVER,
+    STATE_FILE_PATH,
+    CHECKPOINT_FILE_PATH,
+    CHECKPOINT_EVERY,
+    PROMETHEUS_TEXTFILE,
+    REJECTS_FILE_PATH,
+)
+from documents import refresh_documents
+from etl import ETL, MultiStageETL, ParallelMultiStageETL, checkpoint_key
 from extractor import connect_to_sqlite3
-from saver import connect_to_postgres
+from initial_load import InitialLoad
+from metrics import (
+    ETLHook,
+    ETLMetrics,
+    LoggingHook,
+    print_summary,
+    write_prometheus_textfile,
+)
+from saver import (
+    SAVERS,
+    BasePostgresSaver,
+    connect_to_postgres,
+    with_primary_key_conflicts,
+)
+from state import JsonFileStorage, State
+from validation import Quarantine, ReferenceIndex
 
+INCREMENTAL_SAVER = "upsert"
+ENGINES = ("sync", "async")
 
-def load_from_sqlite(sqlite_cur: sqlite3.Cursor, pg_cur: _cursor):
-    """Основной метод загрузки данных из SQLite в Postgres"""
+
+def load_from_sqlite(
+    sqlite_cur: sqlite3.Cursor,
+    pg_cur: _cursor,
+    saver: str = SAVER,
+    pipelined: bool = False,
+    modified_since: dict[str, str | None] | None = None,
+    checkpoint: State | None = None,
+    resume: bool = False,
+    tuple_rows: bool = False,
+    memory_budget: int = MEMORY_BUDGET,
+    auto_chunk_size: bool = False,
+    references: ReferenceIndex | None = None,
+    hooks: tuple[ETLHook, ...] = (),
+    deferred_indexes: bool = False,
+) -> dict[str, str | None]:
+    """Основной метод загрузки данных из SQLite в Postgres
+
+    Возвращает отметки последних изменений по таблицам, если задан modified_since
+    """
     etl = MultiStageETL(sqlite_cur, pg_cur)
-    etl.set_chunk_size(CHUNK_SIZE)
+    _configure_etl(
+        etl,
+        SAVERS[saver],
+        pipelined,
+        modified_since,
+        checkpoint,
+        resume,
+        tuple_rows,
+        memory_budget,
+        auto_chunk_size,
+        references,
+        hooks,
+        deferred_indexes,
+    )
+    etl.run()
+    return etl.high_water_marks
+
+
+def load_from_sqlite_parallel(
+    sqlite_path: str,
+    pg_dsl: dict,
+    saver: str = SAVER,
+    pipelined: bool = False,
+    partitions: int = PARTITIONS,
+    modified_since: dict[str, str | None] | None = None,
+    checkpoint: State | None = None,
+    resume: bool = False,
+    tuple_rows: bool = False,
+    memory_budget: int = MEMORY_BUDGET,
+    auto_chunk_size: bool = False,
+    references: ReferenceIndex | None = None,
+    hooks: tuple[ETLHook, ...] = (),
+    deferred_indexes: bool = False,
+) -> dict[str, str | None]:
+    """Загрузка таблиц каждой стадии параллельно, каждая на своём соединении"""
+    etl = ParallelMultiStageETL(sqlite_path, pg_dsl)
+    _configure_etl(
+        etl,
+        SAVERS[saver],
+        pipelined,
+        modified_since,
+        checkpoint,
+        resume,
+        tuple_rows,
+        memory_budget,
+        auto_chunk_size,
+        references,
+        hooks,
+        deferred_indexes,
+    )
+    etl.set_partitions(partitions)
+    etl.run()
+    return etl.high_water_marks
+
+
+def load_from_sqlite_async(
+    sqlite_path: str,
+    pg_dsl: dict,
+    saver: str = SAVER,
+    pool_size: int = ASYNC_POOL_SIZE,
+    in_flight: int = ASYNC_IN_FLIGHT,
+    modified_since: dict[str, str | None] | None = None,
+    checkpoint: State | None = None,
+    resume: bool = False,
+    tuple_rows: bool = False,
+    memory_budget: int = MEMORY_BUDGET,
+    auto_chunk_size: bool = False,
+    references: ReferenceIndex | None = None,
+    hooks: tuple[ETLHook, ...] = (),
+    deferred_indexes: bool = False,
+) -> dict[str, str | None]:
+    """Загрузка на asyncio: несколько чанков пишутся одновременно через пул asyncpg"""
+    # asyncpg is an optional dependency, needed only for this engine
+    from async_etl import ASYNC_SAVERS, AsyncMultiStageETL
+
+    etl = AsyncMultiStageETL(sqlite_path, pg_dsl)
+    _configure_etl(
+        etl,
+        ASYNC_SAVERS[saver],
+        False,
+        modified_since,
+        checkpoint,
+        resume,
+        tuple_rows,
+        memory_budget,
+        auto_chunk_size,
+        references,
+        hooks,
+        deferred_indexes,
+    )
+    etl.set_pool_size(pool_size)
+    etl.set_in_flight(in_flight)
     etl.run()
+    return etl.high_water_marks
+
+
+def _configure_etl(
+    etl: ETL,
+    saver_class: type[BasePostgresSaver],
+    pipelined: bool,
+    modified_since: dict[str, str | None] | None,
+    checkpoint: State | None,
+    resume: bool,
+    tuple_rows: bool,
+    memory_budget: int,
+    auto_chunk_size: bool,
+    references: ReferenceIndex | None,
+    hooks: tuple[ETLHook, ...],
+    deferred_indexes: bool,
+) -> None:
+    etl.set_chunk_size(CHUNK_SIZE)
+    if deferred_indexes:
+        etl.set_saver(with_primary_key_conflicts(saver_class))
+    else:
+        etl.set_saver(saver_class)
+    etl.set_tuple_rows(tuple_rows)
+    etl.set_memory_budget(memory_budget)
+    etl.set_auto_chunk_size(auto_chunk_size)
+    if references is not None:
+        etl.set_reference_index(references)
+    for hook in hooks:
+        etl.add_hook(hook)
+    if pipelined:
+        etl.set_queue_size(QUEUE_SIZE)
+    if modified_since is not None:
+        etl.set_modified_since(modified_since)
+    if checkpoint is not None:
+        etl.set_checkpoint(checkpoint, CHECKPOINT_EVERY, resume)
+
+
+def get_modified_since(state: State) -> dict[str, str | None]:
+    return {
+        table: state.get_state(f"{table}.modified")
+        for table in MultiStageETL.TABLES
+    }
+
+
+def save_high_water_marks(state: State, high_water_marks: dict[str, str | None]) -> None:
+    for table, mark in high_water_marks.items():
+        state.set_state(f"{table}.modified", mark)
+
+
+def clear_checkpoint(checkpoint: State) -> None:
+    for table in MultiStageETL.TABLES:
+        checkpoint.set_state(checkpoint_key(table), None)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load movies data from SQLite to Postgres")
+    parser.add_argument(
+        "--saver",
+        choices=tuple(SAVERS),
+        default=SAVER,
+        help="strategy used to write chunks to Postgres",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="run extract, transform and save stages in separate threads",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="sync",
+        help="async writes several chunks concurrently over a pool of asyncpg "
+        "connections (ASYNC_POOL_SIZE, up to ASYNC_IN_FLIGHT chunks at once)",
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="load independent tables of each stage on separate connections",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=PARTITIONS,
+        help="split large tables into N id ranges loaded by worker processes "
+        "(used with --parallel)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="load only rows changed since the previous incremental run "
+        f"and upsert them (state is kept in {STATE_FILE_PATH})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue each table from the last id stored in "
+        f"{CHECKPOINT_FILE_PATH} by an interrupted run",
+    )
+    parser.add_argument(
+        "--tuple-rows",
+        action="store_true",
+        help="keep rows as positional tuples instead of dicts and dataclasses",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=MEMORY_BUDGET,
+        help="approximate bytes one chunk may hold, chunks are sized from "
+        "the observed row width up to CHUNK_SIZE rows (0 disables)",
+    )
+    parser.add_argument(
+        "--auto-chunk-size",
+        action="store_true",
+        help="tune the chunk size of every table by the save latency, starting "
+        "from CHUNK_SIZE, the chosen sizes are logged",
+    )
+    parser.add_argument(
+        "--validate-references",
+        action="store_true",
+        help="check film work, genre and person ids of link rows against the loaded "
+        f"ones and write orphans to {REJECTS_FILE_PATH} instead of loading them",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="log every chunk and print per-table and per-stage metrics at the end",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        default=PROMETHEUS_TEXTFILE,
+        help="write metrics to this file for the node_exporter textfile collector",
+    )
+    parser.add_argument(
+        "--initial-load",
+        action="store_true",
+        help="if the target tables are empty, drop secondary indexes and foreign keys "
+        "for the load and rebuild them at the end",
+    )
+    parser.add_argument(
+        "--refresh-documents",
+        action="store_true",
+        help="rebuild the film work documents of the movies admin for the loaded "
+        "film works, all of them unless --incremental",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    with connect_to_sqlite3(SQLITE_DB_PATH) as sqlite_cur, connect_to_postgres(
-        PG_DSL, DictCursor
-    ) as pg_cur:
-        load_from_sqlite(sqlite_cur, pg_cur)
+    args = parse_args()
+
+    state = State(JsonFileStorage(STATE_FILE_PATH))
+    modified_since, saver = None, args.saver
+    if args.incremental:
+        modified_since = get_modified_since(state)
+        saver = INCREMENTAL_SAVER
+
+    initial_load = InitialLoad(MultiStageETL.TABLES, state)
+    deferred_indexes = False
+    if args.initial_load or initial_load.pending:
+        with connect_to_postgres(PG_DSL, DictCursor) as pg_cur:
+            deferred_indexes = initial_load.prepare(pg_cur)
+
+    references = None
+    if args.validate_references:
+        references = ReferenceIndex(Quarantine(REJECTS_FILE_PATH))
+
+    # without a metrics output the chunks are not measured at all
+    metrics = ETLMetrics()
+    hooks = ()
+    if args.metrics:
+        hooks = (metrics, LoggingHook())
+    elif args.prometheus_textfile:
+        hooks = (metrics,)
+
+    checkpoint = None
+    if CHECKPOINT_EVERY:
+        checkpoint = State(JsonFileStorage(CHECKPOINT_FILE_PATH))
+
+    if args.engine == "async":
+        high_water_marks = load_from_sqlite_async(
+            SQLITE_DB_PATH,
+            PG_DSL,
+            saver=saver,
+            modified_since=modified_since,
+            checkpoint=checkpoint,
+            resume=args.resume,
+            tuple_rows=args.tuple_rows,
+            memory_budget=args.memory_budget,
+            auto_chunk_size=args.auto_chunk_size,
+            references=references,
+            hooks=hooks,
+            deferred_indexes=deferred_indexes,
+        )
+    elif args.parallel:
+        high_water_marks = load_from_sqlite_parallel(
+            SQLITE_DB_PATH,
+            PG_DSL,
+            saver=saver,
+            pipelined=args.pipelined,
+            partitions=args.partitions,
+            modified_since=modified_since,
+            checkpoint=checkpoint,
+            resume=args.resume,
+            tuple_rows=args.tuple_rows,
+            memory_budget=args.memory_budget,
+            auto_chunk_size=args.auto_chunk_size,
+            references=references,
+            hooks=hooks,
+            deferred_indexes=deferred_indexes,
+        )
+    else:
+        with connect_to_sqlite3(SQLITE_DB_PATH) as sqlite_cur, connect_to_postgres(
+            PG_DSL, DictCursor
+        ) as pg_cur:
+            high_water_marks = load_from_sqlite(
+                sqlite_cur,
+                pg_cur,
+                saver=saver,
+                pipelined=args.pipelined,
+                modified_since=modified_since,
+                checkpoint=checkpoint,
+                resume=args.resume,
+                tuple_rows=args.tuple_rows,
+                memory_budget=args.memory_budget,
+                auto_chunk_size=args.auto_chunk_size,
+                references=references,
+                hooks=hooks,
+                deferred_indexes=deferred_indexes,
+            )
+
+    if deferred_indexes:
+        initial_load.finish(PG_DSL)
+
+    # before the marks are saved, so a failed refresh is retried by the next run
+    if args.refresh_documents:
+        with connect_to_postgres(PG_DSL, DictCursor) as pg_cur:
+            refresh_documents(pg_cur, modified_since)
+
+    # state is updated only once all the data is committed
+    if args.incremental:
+        save_high_water_marks(state, high_water_marks)
+    if checkpoint is not None:
+        clear_checkpoint(checkpoint)
+
+    if args.metrics:
+        print_summary(metrics)
+    if args.prometheus_textfile:
+        write_prometheus_textfile(metrics, args.prometheus_textfile)
@@ -0,0 +1,162 @@
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, fields as dataclass_fields, is_dataclass
+from typing import Any, Protocol
+
+METRIC_PREFIX = "movies_etl"
+
+
+@dataclass(frozen=True)
+class ChunkEvent:
+    table: str
+    stage: str
+    rows: int
+    seconds: float
+    bytes: int = 0
+
+
+class ETLHook(Protocol):
+    def on_chunk(self, event: ChunkEvent) -> None:
+        ...
+
+
+class LoggingHook(ETLHook):
+    """Logs every processed chunk at DEBUG level"""
+
+    def on_chunk(self, event: ChunkEvent) -> None:
+        logging.debug(
+            f"{event.table} {event.stage}: {event.rows} rows in "
+            f"{event.seconds * 1000:.1f} ms, {event.bytes} bytes"
+        )
+
+
+@dataclass
+class StageMetrics:
+    chunks: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    max_chunk_seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class ETLMetrics(ETLHook):
+    """Aggregates chunk events per table and stage
+
+    Safe to share between the threads of ParallelMultiStageETL.
+    """
+
+    stages: dict[tuple[str, str], StageMetrics] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def on_chunk(self, event: ChunkEvent) -> None:
+        with self._lock:
+            metrics = self.stages.setdefault((event.table, event.stage), StageMetrics())
+            metrics.chunks += 1
+            metrics.rows += event.rows
+            metrics.seconds += event.seconds
+            metrics.bytes += event.bytes
+            metrics.max_chunk_seconds = max(metrics.max_chunk_seconds, event.seconds)
+
+    def summary(self) -> str:
+        lines = [
+            f"{'table':<17} {'stage':<12} {'chunks':>7} {'rows':>10} "
+            f"{'seconds':>9} {'rows/s':>10} {'max chunk':>10} {'bytes':>12}"
+        ]
+        for (table, stage), metrics in self.stages.items():
+            lines.append(
+                f"{table:<17} {stage:<12} {metrics.chunks:>7} {metrics.rows:>10} "
+                f"{metrics.seconds:>9.3f} {metrics.rows_per_sec:>10.0f} "
+                f"{metrics.max_chunk_seconds:>10.3f} {metrics.bytes:>12}"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class PeakMemoryHook(ETLHook):
+    """Tracks the process RSS per table, sampled at every chunk
+
+    RSS rarely shrinks, so besides the peak the growth over the first
+    sample of the table is kept.
+    """
+
+    peak: dict[str, int] = field(default_factory=dict)
+    first: dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def on_chunk(self, event: ChunkEvent) -> None:
+        rss = current_rss_bytes()
+        with self._lock:
+            self.first.setdefault(event.table, rss)
+            self.peak[event.table] = max(self.peak.get(event.table, 0), rss)
+
+    def growth(self, table: str) -> int:
+        return self.peak.get(table, 0) - self.first.get(table, 0)
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of the process, the peak one where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def print_summary(metrics: ETLMetrics) -> None:
+    print(metrics.summary())
+
+
+def write_prometheus_textfile(metrics: ETLMetrics, path: str) -> None:
+    """Write metrics in the Prometheus text format for the node_exporter
+    textfile collector. The file is replaced atomically, so the collector
+    never reads a partial file
+    """
+    series = (
+        ("chunks_total", "counter", "Chunks processed", lambda m: m.chunks),
+        ("rows_total", "counter", "Rows processed", lambda m: m.rows),
+        ("seconds_total", "counter", "Time spent processing chunks", lambda m: m.seconds),
+        ("bytes_total", "counter", "Approximate payload bytes sent", lambda m: m.bytes),
+        ("rows_per_second", "gauge", "Throughput of the stage", lambda m: m.rows_per_sec),
+        ("chunk_seconds_max", "gauge", "Slowest chunk", lambda m: m.max_chunk_seconds),
+    )
+    lines = []
+    for name, kind, help_text, value in series:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for (table, stage), stage_metrics in metrics.stages.items():
+            lines.append(
+                f'{METRIC_PREFIX}_{name}{{table="{table}",stage="{stage}"}} '
+                f"{value(stage_metrics)}"
+            )
+    lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start of the last run")
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {metrics.started_at}")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def payload_size(items: list[Any]) -> int:
+    """Approximate size of the chunk in the Postgres text protocol"""
+    size = 0
+    for item in items:
+        if is_dataclass(item):
+            values = (getattr(item, field.name) for field in dataclass_fields(item))
+        else:
+            values = item
+        size += sum(len(str(value)) for value in values if value is not None)
+    return size
@@ -0,0 +1,214 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+STAGES = ("extractor", "transformer", "saver")
+
+
+class _TrackedQueue(queue.Queue):
+    """Bounded queue which remembers its high-water mark"""
+
+    def _init(self, maxsize: int) -> None:
+        super()._init(maxsize)
+        self.high_water = 0
+
+    def _put(self, item: Any) -> None:
+        super()._put(item)
+        if item is not _DONE:
+            self.high_water = max(self.high_water, self._qsize())
+
+
+@dataclass
+class StageStats:
+    name: str
+    chunks: int = 0
+    rows: int = 0
+    busy: float = 0.0
+    waiting_input: float = 0.0
+    waiting_output: float = 0.0
+
+
+@dataclass
+class PipelineStats:
+    table: str
+    queue_size: int
+    elapsed: float = 0.0
+    stages: dict[str, StageStats] = field(default_factory=dict)
+    high_water_marks: dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def create(cls, table: str, queue_size: int) -> "PipelineStats":
+        stats = cls(table=table, queue_size=queue_size)
+        for name in STAGES:
+            stats.stages[name] = StageStats(name)
+        return stats
+
+    @property
+    def rows(self) -> int:
+        return self.stages["extractor"].rows
+
+    def summary(self) -> str:
+        lines = [
+            f"Pipeline stats for {self.table} (queue size {self.queue_size}): "
+            f"rows={self.rows} elapsed={self.elapsed:.3f}s"
+        ]
+        for stage in self.stages.values():
+            lines.append(
+                f"  {stage.name}: chunks={stage.chunks} busy={stage.busy:.3f}s "
+                f"waiting_input={stage.waiting_input:.3f}s "
+                f"waiting_output={stage.waiting_output:.3f}s"
+            )
+        for name, high_water in self.high_water_marks.items():
+            lines.append(f"  queue {name}: high_water={high_water}/{self.queue_size}")
+        return "\n".join(lines)
+
+
+class ChunkPipeline:
+    """Runs extract, transform and save stages concurrently
+
+    Extraction runs in the calling thread (sqlite3 cursors may not be
+    shared between threads), transformation and saving run in their own
+    threads. Stages are joined by bounded queues, so a slow stage blocks
+    the upstream ones instead of buffering the whole table in memory.
+
+    `on_chunk(stage, chunk, seconds)` is called from the stage's thread
+    after every processed chunk.
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        on_chunk: Callable[[str, Any, float], None] | None = None,
+    ) -> None:
+        self._queue_size = queue_size
+        self._on_chunk = on_chunk
+        self._failed = threading.Event()
+        self._errors: list[BaseException] = []
+
+    def run(
+        self,
+        table: str,
+        chunks: Iterable[Any],
+        transform: Callable[[Any], Any],
+        save: Callable[[Any], None],
+    ) -> PipelineStats:
+        stats = PipelineStats.create(table, self._queue_size)
+        started = time.perf_counter()
+
+        to_transform = _TrackedQueue(self._queue_size)
+        to_save = _TrackedQueue(self._queue_size)
+        workers = (
+            threading.Thread(
+                target=self._worker,
+                args=(to_transform, to_save, transform, stats.stages["transformer"]),
+                name=f"{table}-transformer",
+            ),
+            threading.Thread(
+                target=self._worker,
+                args=(to_save, None, save, stats.stages["saver"]),
+                name=f"{table}-saver",
+            ),
+        )
+        for worker in workers:
+            worker.start()
+
+        try:
+            self._produce(chunks, to_transform, stats.stages["extractor"])
+        except BaseException:
+            self._failed.set()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        stats.high_water_marks = {
+            "extractor->transformer": to_transform.high_water,
+            "transformer->saver": to_save.high_water,
+        }
+        stats.elapsed = time.perf_counter() - started
+        logging.info(stats.summary())
+        return stats
+
+    def _produce(
+        self, chunks: Iterable[Any], output: queue.Queue, stats: StageStats
+    ) -> None:
+        iterator = iter(chunks)
+        while not self._failed.is_set():
+            start = time.perf_counter()
+            chunk = next(iterator, _DONE)
+            seconds = time.perf_counter() - start
+            stats.busy += seconds
+
+            if chunk is not _DONE:
+                stats.chunks += 1
+                stats.rows += len(chunk)
+                if self._on_chunk is not None:
+                    self._on_chunk(stats.name, chunk, seconds)
+
+            self._put(output, chunk, stats)
+            if chunk is _DONE:
+                return
+
+    def _worker(
+        self,
+        input: queue.Queue,
+        output: queue.Queue | None,
+        func: Callable[[Any], Any],
+        stats: StageStats,
+    ) -> None:
+        try:
+            while True:
+                chunk = self._get(input, stats)
+                if chunk is _DONE:
+                    break
+
+                start = time.perf_counter()
+                result = func(chunk)
+                seconds = time.perf_counter() - start
+                stats.busy += seconds
+                stats.chunks += 1
+                stats.rows += len(chunk)
+                if self._on_chunk is not None:
+                    self._on_chunk(stats.name, chunk, seconds)
+
+                if output is not None:
+                    self._put(output, result, stats)
+        except BaseException as e:
+            logging.error(f"Pipeline stage {stats.name} failed: {e}")
+            self._errors.append(e)
+            self._failed.set()
+        finally:
+            if output is not None:
+                self._put(output, _DONE, stats)
+
+    def _put(self, output: queue.Queue, item: Any, stats: StageStats) -> None:
+        start = time.perf_counter()
+        while not self._failed.is_set() or item is _DONE:
+            try:
+                output.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                if self._failed.is_set():
+                    break
+        stats.waiting_output += time.perf_counter() - start
+
+    def _get(self, input: queue.Queue, stats: StageStats) -> Any:
+        start = time.perf_counter()
+        try:
+            while not self._failed.is_set():
+                try:
+                    return input.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+            return _DONE
+        finally:
+            stats.waiting_input += time.perf_counter() - start
@@ -1,7 +1,9 @@
+import io
 import logging
 from abc import ABC, abstractmethod
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from dataclasses import fields as dataclass_fields
+from functools import lru_cache, partial
 from typing import Any
 
 import psycopg2
@@ -9,6 +11,7 @@ from psycopg2 import extras
 from psycopg2.extensions import connection as _connection
 from psycopg2.extensions import cursor as _cursor
 
+from config import VALUES_PAGE_SIZE
 from dto import DTO_TABLES_MAPPING
 
 DEFAULT_SCHEMA = "content"
@@ -18,13 +21,53 @@ BASE_INSERT_STMT = """
             ON CONFLICT ({unique_fields}) DO NOTHING;
             """
 
+BASE_UPSERT_STMT = """
+            INSERT INTO {schema}.{table} ({fields})
+            VALUES {args}
+            ON CONFLICT ({unique_fields}) DO UPDATE SET {updates};
+            """
+STAGING_TABLE_STMT = """
+            CREATE TEMP TABLE IF NOT EXISTS {staging}
+            (LIKE {schema}.{table} INCLUDING DEFAULTS);
+            TRUNCATE {staging};
+            """
+COPY_STMT = "COPY {staging} ({fields}) FROM STDIN"
+MERGE_STMT = """
+            INSERT INTO {schema}.{table} ({fields})
+            SELECT {fields} FROM {staging}
+            ON CONFLICT ({unique_fields}) DO NOTHING;
+            """
+PREPARED_EXISTS_STMT = """
+            SELECT EXISTS (SELECT 1 FROM pg_prepared_statements WHERE name = %s)
+            """
+PREPARE_STMT = "PREPARE {name} AS {stmt}"
+EXECUTE_STMT = "EXECUTE {name} ({args})"
+
 ID_UNIQUE_FIELDS = ("id",)
 GENRE_FILMWORK_UNIQUE_FIELDS = ("genre_id", "film_work_id")
+UNIQUE_FIELDS = {
+    "genre_film_work": GENRE_FILMWORK_UNIQUE_FIELDS,
+}
 
 
 class BasePostgresSaver(ABC):
-    def __init__(self, cursor: _cursor):
+    """Savers are created once per table and connection, statements are
+    prepared on the server on first use and executed by name afterwards
+    """
+
+    STATEMENT_NAME = "insert"
+
+    def __init__(
+        self,
+        cursor: _cursor,
+        unique_fields: dict[str, tuple[str, ...]] = UNIQUE_FIELDS,
+    ):
+        """unique_fields are the conflict targets of the tables which are
+        not deduplicated by the primary key
+        """
         self._cursor = cursor
+        self._unique_fields = unique_fields
+        self._prepared: dict[str, str] = {}
 
     @abstractmethod
     def save(self, table: str, data: list[Any]) -> None:
@@ -39,30 +82,42 @@ class BasePostgresSaver(ABC):
         items: list,
     ) -> None:
 
-        data = [tuple(getattr(item, field) for field in fields) for item in items]
+        if items and isinstance(items[0], tuple):
+            data = items
+        else:
+            data = [_to_values(item, fields) for item in items]
 
-        args = f"({', '.join(['%s'] * len(fields))})"
-            
-        stmt = stmt.format(
-            schema=DEFAULT_SCHEMA,
-            table=table,
-            args=args,
-            fields=", ".join(fields),
-            unique_fields=", ".join(unique_fields),
-        )
-        extras.execute_batch(self._cursor, stmt, data)
+        name = "_".join((self.STATEMENT_NAME, table, *unique_fields))
+        try:
+            execute = self._prepared.get(name)
+            if execute is None:
+                execute = self._prepare(
+                    name, format_insert_stmt(stmt, table, fields, unique_fields), fields
+                )
+            extras.execute_batch(self._cursor, execute, data)
+        except psycopg2.Error as e:
+            logging.error(f"Error occurred while inserting data: {e}")
+            raise e
+
+    def _prepare(self, name: str, stmt: str, fields: tuple[str, ...]) -> str:
+        """PREPARE the statement once per session, returns the EXECUTE to send"""
+        self._cursor.execute(PREPARED_EXISTS_STMT, (name,))
+        if not self._cursor.fetchone()[0]:
+            self._cursor.execute(PREPARE_STMT.format(name=name, stmt=stmt))
+        execute = EXECUTE_STMT.format(name=name, args=", ".join(["%s"] * len(fields)))
+        self._prepared[name] = execute
+        return execute
 
     def _get_dataclass_fields(self, dataclass: type) -> tuple[str, ...]:
-        return tuple(field.name for field in dataclass_fields(dataclass))
+        return get_dataclass_fields(dataclass)
+
+    def _get_unique_fields(self, table: str) -> tuple[str, ...]:
+        return self._unique_fields.get(table, ID_UNIQUE_FIELDS)
 
 
 class PostgresSaver(BasePostgresSaver):
     def save(self, table: str, items: list[Any]) -> None:
-        unique_fields = (
-            ID_UNIQUE_FIELDS
-            if table != "genre_film_work"
-            else GENRE_FILMWORK_UNIQUE_FIELDS
-        )
+        unique_fields = self._get_unique_fields(table)
         self._perform_insert(
             table=table,
             stmt=BASE_INSERT_STMT,
@@ -72,6 +127,168 @@ class PostgresSaver(BasePostgresSaver):
         )
 
 
+class PostgresUpsertSaver(BasePostgresSaver):
+    """Saver which overwrites already loaded rows with the new values"""
+
+    STATEMENT_NAME = "upsert"
+
+    def save(self, table: str, items: list[Any]) -> None:
+        self._perform_insert(
+            table=table,
+            stmt=BASE_UPSERT_STMT,
+            fields=self._get_dataclass_fields(DTO_TABLES_MAPPING[table]),
+            unique_fields=self._get_unique_fields(table),
+            items=items,
+        )
+
+
+class PostgresValuesSaver(BasePostgresSaver):
+    """Saver which sends page_size rows per INSERT as one multi-row
+    VALUES list with execute_values
+    """
+
+    def __init__(
+        self,
+        cursor: _cursor,
+        unique_fields: dict[str, tuple[str, ...]] = UNIQUE_FIELDS,
+        page_size: int = VALUES_PAGE_SIZE,
+    ):
+        super().__init__(cursor, unique_fields)
+        self._page_size = page_size
+
+    def save(self, table: str, items: list[Any]) -> None:
+        fields = self._get_dataclass_fields(DTO_TABLES_MAPPING[table])
+        stmt = format_insert_stmt(
+            BASE_INSERT_STMT, table, fields, self._get_unique_fields(table), args="%s"
+        )
+        try:
+            extras.execute_values(
+                self._cursor,
+                stmt,
+                [_to_values(item, fields) for item in items],
+                page_size=self._page_size,
+            )
+        except psycopg2.Error as e:
+            logging.error(f"Error occurred while inserting data: {e}")
+            raise e
+
+
+class PostgresCopySaver(BasePostgresSaver):
+    """Saver which streams chunks with COPY into a temporary staging
+    table and merges them into the target table with a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING
+    """
+
+    def __init__(
+        self,
+        cursor: _cursor,
+        unique_fields: dict[str, tuple[str, ...]] = UNIQUE_FIELDS,
+    ):
+        super().__init__(cursor, unique_fields)
+        self._statements: dict[str, tuple[str, str, str]] = {}
+
+    def save(self, table: str, items: list[Any]) -> None:
+        fields = self._get_dataclass_fields(DTO_TABLES_MAPPING[table])
+        if table not in self._statements:
+            params = dict(
+                schema=DEFAULT_SCHEMA,
+                table=table,
+                staging=f"staging_{table}",
+                fields=", ".join(fields),
+                unique_fields=", ".join(self._get_unique_fields(table)),
+            )
+            self._statements[table] = (
+                STAGING_TABLE_STMT.format(**params),
+                COPY_STMT.format(**params),
+                MERGE_STMT.format(**params),
+            )
+        staging_stmt, copy_stmt, merge_stmt = self._statements[table]
+        try:
+            self._cursor.execute(staging_stmt)
+            self._cursor.copy_expert(copy_stmt, self._to_copy_buffer(fields, items))
+            self._cursor.execute(merge_stmt)
+        except psycopg2.Error as e:
+            logging.error(f"Error occurred while copying data: {e}")
+            raise e
+
+    def _to_copy_buffer(self, fields: tuple[str, ...], items: list) -> io.StringIO:
+        buffer = io.StringIO()
+        for item in items:
+            buffer.write(
+                "\t".join(_to_copy_value(value) for value in _to_values(item, fields))
+            )
+            buffer.write("\n")
+        buffer.seek(0)
+        return buffer
+
+
+@lru_cache
+def get_dataclass_fields(dataclass: type) -> tuple[str, ...]:
+    return tuple(field.name for field in dataclass_fields(dataclass))
+
+
+@lru_cache
+def format_insert_stmt(
+    stmt: str,
+    table: str,
+    fields: tuple[str, ...],
+    unique_fields: tuple[str, ...],
+    args: str | None = None,
+) -> str:
+    """Render an INSERT template, by default with positional $n parameters"""
+    if args is None:
+        args = f"({', '.join(f'${i}' for i in range(1, len(fields) + 1))})"
+    return stmt.format(
+        schema=DEFAULT_SCHEMA,
+        table=table,
+        args=args,
+        fields=", ".join(fields),
+        unique_fields=", ".join(unique_fields),
+        updates=", ".join(
+            f"{field} = EXCLUDED.{field}"
+            for field in fields
+            if field not in unique_fields and field not in ID_UNIQUE_FIELDS
+        ),
+    )
+
+
+def with_primary_key_conflicts(saver_class: type[BasePostgresSaver]) -> partial:
+    """Saver factory resolving conflicts by the primary key only, for loads
+    into tables whose secondary unique indexes are dropped
+    """
+    return partial(saver_class, unique_fields={})
+
+
+SAVERS = {
+    "insert": PostgresSaver,
+    "copy": PostgresCopySaver,
+    "upsert": PostgresUpsertSaver,
+    "values": PostgresValuesSaver,
+}
+
+
+def _to_values(item: Any, fields: tuple[str, ...]) -> tuple:
+    """Records from SQLiteToPGRecordTransformer are already tuples in
+    the order of the dataclass fields, dataclasses are taken apart
+    """
+    if isinstance(item, tuple):
+        return item
+    return tuple(getattr(item, field) for field in fields)
+
+
+def _to_copy_value(value: Any) -> str:
+    """Render value in COPY text format"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
 @contextmanager
 def connect_to_postgres(DSL: dict, cursor_factory: Any) -> _cursor:
     pg_conn: _connection = psycopg2.connect(**DSL, cursor_factory=cursor_factory)
@@ -85,3 +302,13 @@ def connect_to_postgres(DSL: dict, cursor_factory: Any) -> _cursor:
         logging.debug("Closing connection")
         pg_conn.commit()
         pg_conn.close()
+
+
+@contextmanager
+def connect_to_postgres_pool(DSL: dict, cursor_factory: Any, size: int) -> list[_cursor]:
+    """Open `size` independent connections, each committed on exit"""
+    with ExitStack() as stack:
+        yield [
+            stack.enter_context(connect_to_postgres(DSL, cursor_factory))
+            for _ in range(size)
+        ]
@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any
+
+
+class BaseStorage(ABC):
+    @abstractmethod
+    def save_state(self, state: dict) -> None:
+        pass
+
+    @abstractmethod
+    def retrieve_state(self) -> dict:
+        pass
+
+
+class JsonFileStorage(BaseStorage):
+    def __init__(self, file_path: str) -> None:
+        self._file_path = file_path
+
+    def save_state(self, state: dict) -> None:
+        tmp_path = f"{self._file_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self._file_path)
+
+    def retrieve_state(self) -> dict:
+        try:
+            with open(self._file_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logging.error(f"State file {self._file_path} is corrupted: {e}")
+            raise e
+
+
+class State:
+    """Persistent key-value state of the ETL"""
+
+    def __init__(self, storage: BaseStorage) -> None:
+        self._storage = storage
+        self._state = storage.retrieve_state()
+        self._lock = threading.Lock()
+
+    def set_state(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._state[key] = value
+            self._storage.save_state(self._state)
+
+    def get_state(self, key: str) -> Any:
+        return self._state.get(key)
@@ -1,5 +1,9 @@
 from unittest import TestCase
+import json
+import os
 import sqlite3
+import tempfile
+import uuid
 from datetime import datetime
 
 import psycopg2
@@ -7,13 +11,27 @@ from psycopg2.extras import DictCursor
 
 from config import PG_DSL, SQLITE_DB_PATH
 
-from dto import Person, FilmWork, Genre, PersonFilmWork, GenreFilmWork
-from load_data import load_from_sqlite
+from dto import Person, FilmWork, Genre, PersonFilmWork, GenreFilmWork, GenreFilmWorkRecord
+from etl import MultiStageETL, checkpoint_key
+from load_data import load_from_sqlite, load_from_sqlite_async
 from extractor import _dict_cursor_factory, SQLiteMovieExtractor
+from state import JsonFileStorage, State
 from transformer import SQLiteToPGTransformer
+from tuning import TOLERANCE, ChunkSizeTuner
+from validation import (
+    LINK_REFERENCES,
+    PARENT_TABLES,
+    Quarantine,
+    ReferenceIndex,
+    load_partial_tables,
+)
+from verify import ChecksumVerifier
+from benchmarks.load import truncate_tables
 
 
 class BaseLoadTestCase(TestCase):
+    saver = "insert"
+
     @classmethod
     def setUpClass(cls):
         cls.sqlite_conn = sqlite3.connect(SQLITE_DB_PATH)
@@ -25,19 +43,29 @@ class BaseLoadTestCase(TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        cls._delete_loaded()
+        cls.pg_conn.close()
+        cls.sqlite_conn.close()
 
+    @classmethod
+    def _delete_loaded(cls):
         cls.cur.execute("DELETE FROM person_film_work;")
         cls.cur.execute("DELETE FROM genre_film_work;")
+        # created by the migrations of the movies admin, not by the DDL
+        cls.cur.execute("SELECT to_regclass('film_work_document');")
+        if cls.cur.fetchone()[0] is not None:
+            cls.cur.execute("DELETE FROM film_work_document;")
         cls.cur.execute("DELETE FROM person;")
         cls.cur.execute("DELETE FROM film_work;")
         cls.cur.execute("DELETE FROM genre;")
         cls.pg_conn.commit()
-        cls.pg_conn.close()
-        cls.sqlite_conn.close()
+
+    def _load(self):
+        load_from_sqlite(self.s_cur, self.cur, saver=self.saver)
 
     def _load_data(self):
         if not self._is_loaded:
-            load_from_sqlite(self.s_cur, self.cur)
+            self._load()
             self._is_loaded = True
 
     def _get_counts_from_pg(self) -> dict:
@@ -120,9 +148,9 @@ class TestDataLoading(BaseLoadTestCase):
 class TestIdempotency(BaseLoadTestCase):
     def _load_data_twice_and_get_counts(self):
         if not self._is_loaded:
-            load_from_sqlite(self.s_cur, self.cur)
+            self._load()
             self.counts1 = self._get_counts_from_pg()
-            load_from_sqlite(self.s_cur, self.cur)
+            self._load()
             self.counts2 = self._get_counts_from_pg()
             self._is_loaded = True
 
@@ -154,10 +182,14 @@ class TestIdempotency(BaseLoadTestCase):
         )
 
 
+class TestCopySaverIdempotency(TestIdempotency):
+    saver = "copy"
+
+
 class TestLoadedDataCount(BaseLoadTestCase):
     def _load_data_and_get_counts(self):
         if not self._is_loaded:
-            load_from_sqlite(self.s_cur, self.cur)
+            self._load()
             self.pg_counts = self._get_counts_from_pg()
             self.sqlite_counts = self._get_counts_from_sqlite()
             self._is_loaded = True
@@ -190,7 +222,7 @@ class TestLoadedDataCount(BaseLoadTestCase):
 class TestLoadedDataMatches(BaseLoadTestCase):
     def _load_data_and_get_data(self):
         if not self._is_loaded:
-            load_from_sqlite(self.s_cur, self.cur)
+            self._load()
             self.pg_data = self._get_data_from_pg()
             self.sqlite_data = self._get_data_from_sqlite()
             self._is_loaded = True
@@ -306,3 +338,215 @@ class TestLoadedDataMatches(BaseLoadTestCase):
             self.assertEqual(s_row.person_id, p_row.person_id)
             self.assertEqual(s_row.role, p_row.role)
             self.assertEqual(datetime.fromisoformat(s_row.created), p_row.created)
+
+
+class TestChecksumVerification(BaseLoadTestCase):
+    def _verify(self, table):
+        self._load_data()
+        report = ChecksumVerifier(self.s_cur, self.cur).verify(table)
+        self.assertTrue(report.ok, report.summary())
+
+    def test_filmwork_checksums_match(self):
+        self._verify("film_work")
+
+    def test_genre_checksums_match(self):
+        self._verify("genre")
+
+    def test_person_checksums_match(self):
+        self._verify("person")
+
+    def test_genre_filmwork_checksums_match(self):
+        self._verify("genre_film_work")
+
+    def test_person_filmwork_checksums_match(self):
+        self._verify("person_film_work")
+
+
+class TestBenchmarkTruncate(BaseLoadTestCase):
+    def test_truncate_empties_loaded_tables_and_documents(self):
+        self._load_data()
+        self.cur.execute("SELECT to_regclass('film_work_document');")
+        has_documents = self.cur.fetchone()[0] is not None
+        if has_documents:
+            self.cur.execute("SELECT refresh_film_work_documents(array(SELECT id FROM film_work));")
+            self.cur.execute("SELECT COUNT(*) FROM film_work_document;")
+            self.assertGreater(self.cur.fetchone()[0], 0)
+        # truncate_tables() uses its own connection
+        self.pg_conn.commit()
+
+        truncate_tables()
+
+        self.assertEqual(set(self._get_counts_from_pg().values()), {0})
+        if has_documents:
+            self.cur.execute("SELECT COUNT(*) FROM film_work_document;")
+            self.assertEqual(self.cur.fetchone()[0], 0)
+
+
+class TestReferenceIndex(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.quarantine = Quarantine(os.path.join(tmp_dir.name, "rejects.jsonl"))
+        self.index = ReferenceIndex(self.quarantine)
+        self.film_work_id, self.genre_id = uuid.uuid4(), uuid.uuid4()
+        self.index.add_ids("film_work", [self.film_work_id])
+        self.index.add_ids("genre", [str(self.genre_id)])
+
+    def _link(self, film_work_id, genre_id):
+        return GenreFilmWork(
+            id=uuid.uuid4(), film_work_id=film_work_id, genre_id=genre_id, created=None
+        )
+
+    def _rejects(self) -> list[dict]:
+        with open(self.quarantine.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_known_references_pass(self):
+        links = [
+            self._link(self.film_work_id, self.genre_id),
+            self._link(str(self.film_work_id), str(self.genre_id)),
+        ]
+        self.assertEqual(self.index.filter("genre_film_work", links), links)
+        self.assertEqual(self.index.rejected, {})
+        self.assertFalse(os.path.exists(self.quarantine.path))
+
+    def test_orphans_quarantined(self):
+        valid = self._link(self.film_work_id, self.genre_id)
+        no_genre = self._link(self.film_work_id, uuid.uuid4())
+        no_parents = self._link("not-a-uuid", None)
+
+        self.assertEqual(
+            self.index.filter("genre_film_work", [valid, no_genre, no_parents]), [valid]
+        )
+        self.assertEqual(self.index.rejected, {"genre_film_work": 2})
+        rejects = self._rejects()
+        self.assertEqual([reject["table"] for reject in rejects], ["genre_film_work"] * 2)
+        self.assertEqual(rejects[0]["missing"], ["genre_id"])
+        self.assertEqual(rejects[0]["row"]["id"], str(no_genre.id))
+        self.assertEqual(rejects[1]["missing"], ["film_work_id", "genre_id"])
+
+    def test_records_quarantined(self):
+        record = GenreFilmWorkRecord(uuid.uuid4(), uuid.uuid4(), self.genre_id, None)
+        self.assertEqual(self.index.filter("genre_film_work", [record]), [])
+        self.assertEqual(self._rejects()[0]["row"]["film_work_id"], str(record.film_work_id))
+
+
+class TestReferenceIndexFromPostgres(BaseLoadTestCase):
+    def test_partial_tables_completed_from_postgres(self):
+        self._load_data()
+        index = ReferenceIndex(Quarantine(os.devnull))
+        for table in PARENT_TABLES:
+            index.mark_partial(table)
+
+        load_partial_tables(index, self.cur)
+
+        self.assertEqual(index.partial_tables, ())
+        for table in LINK_REFERENCES:
+            self.s_cur.execute(f"SELECT * FROM {table};")
+            links = SQLiteToPGTransformer(self.s_cur.fetchall(), table).transform()
+            self.assertEqual(len(index.filter(table, links)), len(links))
+        self.assertEqual(index.rejected, {})
+
+
+class TestResumeFromCheckpoint(BaseLoadTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(self._delete_loaded)
+        self.state = State(JsonFileStorage(os.path.join(tmp_dir.name, "state.json")))
+
+    def _sqlite_ids(self, table: str) -> list[str]:
+        self.s_cur.execute(f"SELECT id FROM {table} ORDER BY id;")
+        return [row["id"] for row in self.s_cur.fetchall()]
+
+    def test_checkpoint_saved(self):
+        load_from_sqlite(self.s_cur, self.cur, checkpoint=self.state)
+
+        for table in MultiStageETL.TABLES:
+            self.assertEqual(
+                self.state.get_state(checkpoint_key(table)), self._sqlite_ids(table)[-1]
+            )
+
+    def test_resume_from_saved_id(self):
+        ids = self._sqlite_ids("person_film_work")
+        middle = len(ids) // 2
+        self.state.set_state(checkpoint_key("person_film_work"), ids[middle])
+
+        load_from_sqlite(self.s_cur, self.cur, checkpoint=self.state, resume=True)
+
+        self.cur.execute("SELECT id::text FROM person_film_work ORDER BY id;")
+        self.assertEqual([row[0] for row in self.cur.fetchall()], ids[middle + 1:])
+        self.assertEqual(self.state.get_state(checkpoint_key("person_film_work")), ids[-1])
+        # tables without a checkpoint are loaded from the start
+        self.assertEqual(
+            self._get_counts_from_pg()["filmwork"], self._get_counts_from_sqlite()["filmwork"]
+        )
+
+
+class TestChunkSizeTuner(TestCase):
+    def _run(self, tuner: ChunkSizeTuner, throughput, chunks: int) -> list[int]:
+        """Sizes of the chunks saved at the given rows/sec per chunk size"""
+        sizes = []
+        for _ in range(chunks):
+            size = tuner.chunk_size
+            sizes.append(size)
+            tuner.observe(size, size / throughput(size))
+        return sizes
+
+    def test_grows_then_settles_on_best_size(self):
+        tuner = ChunkSizeTuner("film_work", 1000)
+        # throughput peaks at 4000 rows per chunk
+        sizes = self._run(tuner, lambda size: 10_000 - abs(size - 4000), 30)
+
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.chunk_size, 4000)
+        self.assertEqual(list(dict.fromkeys(sizes)), [1000, 2000, 4000, 8000])
+        self.assertEqual(sizes[-1], 4000)
+
+    def test_shrinks_when_smaller_chunks_are_faster(self):
+        tuner = ChunkSizeTuner("film_work", 1000)
+        sizes = self._run(tuner, lambda size: 10_000 - 4 * abs(size - 250), 30)
+
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.chunk_size, 250)
+        self.assertEqual(list(dict.fromkeys(sizes)), [1000, 2000, 500, 250, 125])
+
+    def test_settles_at_bound(self):
+        tuner = ChunkSizeTuner("film_work", 1000, max_size=4000)
+        self._run(tuner, lambda size: size, 30)
+
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.chunk_size, 4000)
+
+    def test_noise_is_ignored(self):
+        tuner = ChunkSizeTuner("film_work", 1000)
+        sizes = self._run(tuner, lambda size: 10_000 + size * (TOLERANCE / 10), 30)
+
+        self.assertTrue(tuner.settled)
+        self.assertEqual(tuner.chunk_size, 1000)
+        self.assertEqual(sizes[-1], 1000)
+
+
+class AsyncEngineMixin:
+    def _load(self):
+        load_from_sqlite_async(SQLITE_DB_PATH, PG_DSL, saver=self.saver)
+
+
+class TestAsyncDataLoading(AsyncEngineMixin, TestDataLoading):
+    pass
+
+
+class TestAsyncIdempotency(AsyncEngineMixin, TestIdempotency):
+    pass
+
+
+class TestAsyncCopySaverIdempotency(AsyncEngineMixin, TestCopySaverIdempotency):
+    pass
+
+
+class TestAsyncLoadedDataCount(AsyncEngineMixin, TestLoadedDataCount):
+    pass
+
+
+class TestAsyncLoadedDataMatches(AsyncEngineMixin, TestLoadedDataMatches):
+    pass
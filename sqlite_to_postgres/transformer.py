@@ -1,6 +1,13 @@
-from typing import Any, Protocol
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Protocol
 
-from dto import DTO_TABLES_MAPPING
+from dto import DTO_TABLES_MAPPING, RECORD_TABLES_MAPPING
+
+RENAMED_COLUMNS = {
+    "created_at": "created",
+    "updated_at": "modified",
+}
 
 
 class BaseTransformer(Protocol):
@@ -32,3 +39,30 @@ class SQLiteToPGTransformer(BaseTransformer):
                 del row["updated_at"]
 
         return self._rows
+
+
+class SQLiteToPGRecordTransformer(BaseTransformer):
+    """Transforms tuple rows into tuple records without building dicts
+
+    Source columns are mapped to the record fields once per table and
+    column layout, every row is then just reordered with itemgetter.
+    """
+
+    def __init__(self, rows: list[tuple], table: str, columns: tuple[str, ...]) -> None:
+        self._table = table
+        self._rows = rows
+        self._columns = columns
+
+    def transform(self) -> list[tuple]:
+        """Transform SQLite rows to Postgres records"""
+        make_record = _get_record_maker(self._table, self._columns)
+        return [make_record(row) for row in self._rows]
+
+
+@lru_cache
+def _get_record_maker(table: str, columns: tuple[str, ...]) -> Callable[[tuple], tuple]:
+    record = RECORD_TABLES_MAPPING[table]
+    renamed = tuple(RENAMED_COLUMNS.get(column, column) for column in columns)
+    getter = itemgetter(*(renamed.index(field) for field in record._fields))
+    new = tuple.__new__
+    return lambda row: new(record, getter(row))
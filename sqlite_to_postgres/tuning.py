@@ -0,0 +1,93 @@
+import logging
+
+MIN_CHUNK_SIZE = 100
+MAX_CHUNK_SIZE = 50_000
+# chunks measured at every size before it is compared with the best one
+SAMPLES = 3
+# smaller gains are treated as noise
+TOLERANCE = 0.05
+
+
+class ChunkSizeTuner:
+    """Searches for the chunk size with the best save throughput of a table
+
+    The size is doubled while rows/sec of the saver keeps improving, then
+    halved from the best size while that improves. When neither direction
+    helps, the best size is kept for the rest of the table.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        chunk_size: int,
+        min_size: int = MIN_CHUNK_SIZE,
+        max_size: int = MAX_CHUNK_SIZE,
+    ) -> None:
+        self._table = table
+        self._min_size = min_size
+        self._max_size = max_size
+        self._size = max(min_size, min(chunk_size, max_size))
+        self._factor = 2.0
+        self._rows = 0
+        self._seconds = 0.0
+        self._samples = 0
+        self._best_size = self._size
+        self._best_throughput = 0.0
+        self.settled = False
+
+    @property
+    def chunk_size(self) -> int:
+        return self._size
+
+    def observe(self, rows: int, seconds: float) -> int:
+        """Record the latency of one saved chunk, returns the next chunk size"""
+        if self.settled or not rows:
+            return self._size
+
+        self._rows += rows
+        self._seconds += seconds
+        self._samples += 1
+        if self._samples < SAMPLES:
+            return self._size
+
+        throughput = self._rows / self._seconds if self._seconds else 0.0
+        self._rows, self._seconds, self._samples = 0, 0.0, 0
+        if throughput > self._best_throughput * (1 + TOLERANCE):
+            self._best_size, self._best_throughput = self._size, throughput
+            self._step(self._size)
+        elif self._factor > 1:
+            self._factor = 0.5
+            self._step(self._best_size)
+        else:
+            self._settle()
+        return self._size
+
+    def log_result(self) -> None:
+        if not self._best_throughput:
+            logging.info(
+                f"{self._table}: chunk size kept at {self._size} rows, "
+                "too few chunks to tune"
+            )
+            return
+        state = "settled at" if self.settled else "best so far"
+        logging.info(
+            f"{self._table}: chunk size {state} {self._best_size} rows "
+            f"({self._best_throughput:.0f} rows/s saved)"
+        )
+
+    def _step(self, size: int) -> None:
+        next_size = max(self._min_size, min(int(size * self._factor), self._max_size))
+        if next_size == size:
+            # the search hit a bound
+            if self._factor > 1 and size == self._best_size:
+                self._factor = 0.5
+                next_size = max(self._min_size, int(size * self._factor))
+            if next_size == size:
+                self._settle()
+                return
+        self._size = next_size
+
+    def _settle(self) -> None:
+        self._size = self._best_size
+        self.settled = True
+        self.log_result()
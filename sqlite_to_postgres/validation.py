@@ -0,0 +1,129 @@
+import json
+import logging
+import threading
+import uuid
+from dataclasses import asdict, is_dataclass
+from typing import Any, Iterable
+
+from psycopg2.extensions import cursor as _cursor
+
+from saver import DEFAULT_SCHEMA
+
+PARENT_TABLES = ("film_work", "genre", "person")
+LINK_REFERENCES = {
+    "genre_film_work": {"film_work_id": "film_work", "genre_id": "genre"},
+    "person_film_work": {"film_work_id": "film_work", "person_id": "person"},
+}
+IDS_SQL = "SELECT id FROM {schema}.{table}"
+IDS_FETCH_SIZE = 10_000
+
+
+class ReferenceIndex:
+    """Ids of the loaded film works, genres and persons kept as sets of
+    16-byte UUIDs, so link rows are checked without asking Postgres
+
+    Parent tables are indexed while they are saved. Tables loaded only in
+    part (incremental runs, resumed or partitioned loads) are marked as
+    partial, and their ids have to be read from Postgres with
+    load_partial_tables before the link tables are checked.
+    """
+
+    def __init__(self, quarantine: "Quarantine") -> None:
+        self._ids: dict[str, set[bytes]] = {table: set() for table in PARENT_TABLES}
+        self._partial: set[str] = set()
+        self._quarantine = quarantine
+        self._lock = threading.Lock()
+        self.rejected: dict[str, int] = {}
+
+    @property
+    def partial_tables(self) -> tuple[str, ...]:
+        return tuple(sorted(self._partial))
+
+    def mark_partial(self, table: str) -> None:
+        with self._lock:
+            self._partial.add(table)
+
+    def clear_partial(self) -> None:
+        with self._lock:
+            self._partial.clear()
+
+    def add(self, table: str, items: list[Any]) -> None:
+        self.add_ids(table, (item.id for item in items))
+
+    def add_ids(self, table: str, ids: Iterable[Any]) -> None:
+        ids = {_uuid_bytes(value) for value in ids}
+        ids.discard(None)
+        with self._lock:
+            self._ids[table] |= ids
+
+    def filter(self, table: str, items: list[Any]) -> list[Any]:
+        """Return the link rows whose references are known, the rest is
+        quarantined
+        """
+        references = LINK_REFERENCES[table]
+        valid, orphans = [], []
+        for item in items:
+            missing = [
+                column
+                for column, parent in references.items()
+                if _uuid_bytes(getattr(item, column)) not in self._ids[parent]
+            ]
+            if missing:
+                orphans.append((item, missing))
+            else:
+                valid.append(item)
+
+        if orphans:
+            self._quarantine.write(table, orphans)
+            with self._lock:
+                self.rejected[table] = self.rejected.get(table, 0) + len(orphans)
+        return valid
+
+    def log_summary(self) -> None:
+        for table, count in self.rejected.items():
+            logging.warning(
+                f"{table}: {count} rows with missing references "
+                f"quarantined to {self._quarantine.path}"
+            )
+
+
+class Quarantine:
+    """Appends rejected rows to a JSON lines file"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, table: str, orphans: list[tuple[Any, list[str]]]) -> None:
+        lines = [
+            json.dumps({"table": table, "missing": missing, "row": _as_dict(item)}, default=str)
+            for item, missing in orphans
+        ]
+        with self._lock, open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def load_partial_tables(index: ReferenceIndex, pg_cur: _cursor) -> None:
+    """Complete the index of partially loaded tables with the ids in Postgres"""
+    for table in index.partial_tables:
+        pg_cur.execute(IDS_SQL.format(schema=DEFAULT_SCHEMA, table=table))
+        while rows := pg_cur.fetchmany(IDS_FETCH_SIZE):
+            index.add_ids(table, (row[0] for row in rows))
+        logging.debug(f"Reference index of {table} completed from Postgres")
+    index.clear_partial()
+
+
+def _uuid_bytes(value: Any) -> bytes | None:
+    """None for empty or malformed ids, which are never found in the index"""
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    try:
+        return uuid.UUID(value).bytes
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _as_dict(item: Any) -> dict:
+    if is_dataclass(item):
+        return asdict(item)
+    return item._asdict()
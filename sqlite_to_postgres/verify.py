@@ -0,0 +1,284 @@
+"""Checksum verification of the loaded data
+
+    python verify.py
+    python verify.py --tables film_work person --ranges 32
+
+Every table is split into id ranges, and a hash of each range is computed
+on both sides: an ordered md5 aggregate in Postgres and a streaming md5
+over the same canonical row text in SQLite. Only the ranges that differ
+are split further, down to ranges small enough to compare row hashes by
+id, so memory stays bounded whatever the size of the tables.
+"""
+import argparse
+import hashlib
+import logging
+import sqlite3
+from dataclasses import dataclass, field, fields as dataclass_fields
+from datetime import date, datetime, timedelta, timezone
+from typing import Any
+
+from psycopg2.extensions import cursor as _cursor
+from psycopg2.extras import DictCursor
+
+from config import PG_DSL, SQLITE_DB_PATH
+from dto import DTO_TABLES_MAPPING
+from extractor import SQLiteMovieExtractor, connect_to_sqlite3
+from saver import DEFAULT_SCHEMA, connect_to_postgres
+from transformer import RENAMED_COLUMNS
+
+RANGES = 16
+# top level ranges are kept this small, so Postgres aggregates at most
+# 32 bytes of row hashes per row of the range
+RANGE_ROWS = 100_000
+LEAF_ROWS = 1000
+MAX_REPORTED_IDS = 20
+NULL = "\\N"
+SEPARATOR = "\x1f"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+PG_RANGE_HASH_SQL = """
+    SELECT count(*), coalesce(md5(string_agg(md5({row}), '' ORDER BY id)), '')
+    FROM {schema}.{table}
+    {where}
+"""
+PG_ROW_HASHES_SQL = """
+    SELECT id::text, md5({row})
+    FROM {schema}.{table}
+    {where}
+    ORDER BY id
+"""
+
+
+@dataclass
+class TableReport:
+    table: str
+    ranges_checked: int = 0
+    missing: list[str] = field(default_factory=list)
+    extra: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.extra or self.changed)
+
+    def summary(self) -> str:
+        if self.ok:
+            return f"{self.table}: OK ({self.ranges_checked} ranges checked)"
+        lines = [f"{self.table}: {self.ranges_checked} ranges checked"]
+        for name, ids in (
+            ("missing in Postgres", self.missing),
+            ("only in Postgres", self.extra),
+            ("different", self.changed),
+        ):
+            if ids:
+                shown = ", ".join(ids[:MAX_REPORTED_IDS])
+                if len(ids) > MAX_REPORTED_IDS:
+                    shown += f" and {len(ids) - MAX_REPORTED_IDS} more"
+                lines.append(f"  {len(ids)} {name}: {shown}")
+        return "\n".join(lines)
+
+
+class ChecksumVerifier:
+    """Compares a table in SQLite and Postgres by range checksums"""
+
+    def __init__(
+        self,
+        sqlite_cur: sqlite3.Cursor,
+        pg_cur: _cursor,
+        ranges: int = RANGES,
+        leaf_rows: int = LEAF_ROWS,
+    ) -> None:
+        self._sqlite_cur = sqlite_cur
+        self._pg_cur = pg_cur
+        self._ranges = ranges
+        self._leaf_rows = leaf_rows
+
+    def verify(self, table: str) -> TableReport:
+        report = TableReport(table)
+        extractor = self._create_extractor(table, (None, None))
+        partitions = max(self._ranges, -(-extractor.count() // RANGE_ROWS))
+        for id_range in extractor.get_id_ranges(partitions):
+            self._verify_range(table, id_range, report)
+        return report
+
+    def _verify_range(
+        self, table: str, id_range: tuple[str | None, str | None], report: TableReport
+    ) -> None:
+        extractor = self._create_extractor(table, id_range)
+        report.ranges_checked += 1
+        count, digest = self._sqlite_range_hash(table, extractor)
+        pg_count, pg_digest = self._pg_range_hash(table, id_range)
+        if (count, digest) == (pg_count, pg_digest):
+            return
+
+        logging.debug(
+            f"{table} {id_range}: {count} rows in SQLite, {pg_count} in Postgres, "
+            "checksums differ"
+        )
+        if max(count, pg_count) <= self._leaf_rows or count <= 1:
+            self._compare_rows(table, extractor, id_range, report)
+            return
+        for sub_range in extractor.get_id_ranges(self._ranges):
+            self._verify_range(table, sub_range, report)
+
+    def _create_extractor(
+        self, table: str, id_range: tuple[str | None, str | None]
+    ) -> SQLiteMovieExtractor:
+        extractor = SQLiteMovieExtractor(self._sqlite_cur, table)
+        extractor.set_id_range(*id_range)
+        extractor.set_chunk_size(self._leaf_rows)
+        return extractor
+
+    def _sqlite_range_hash(
+        self, table: str, extractor: SQLiteMovieExtractor
+    ) -> tuple[int, str]:
+        digest = hashlib.md5()
+        count = 0
+        for _, row_hash in self._sqlite_row_hashes(table, extractor):
+            digest.update(row_hash.encode())
+            count += 1
+        return count, digest.hexdigest() if count else ""
+
+    def _sqlite_row_hashes(self, table: str, extractor: SQLiteMovieExtractor):
+        extractor.set_tuple_rows(True)
+        columns = _columns(table)
+        for rows in extractor.extract():
+            positions = [extractor.columns.index(_sqlite_column(name)) for name, _ in columns]
+            for row in rows:
+                text = SEPARATOR.join(
+                    _canonical(row[position], kind)
+                    for position, (_, kind) in zip(positions, columns)
+                )
+                yield str(row[positions[0]]), hashlib.md5(text.encode()).hexdigest()
+
+    def _pg_range_hash(
+        self, table: str, id_range: tuple[str | None, str | None]
+    ) -> tuple[int, str]:
+        where, params = _pg_where(id_range)
+        self._pg_cur.execute(
+            PG_RANGE_HASH_SQL.format(
+                row=_pg_row_expression(table), schema=DEFAULT_SCHEMA, table=table, where=where
+            ),
+            params,
+        )
+        count, digest = self._pg_cur.fetchone()
+        return count, digest
+
+    def _compare_rows(
+        self,
+        table: str,
+        extractor: SQLiteMovieExtractor,
+        id_range: tuple[str | None, str | None],
+        report: TableReport,
+    ) -> None:
+        source = dict(self._sqlite_row_hashes(table, extractor))
+        where, params = _pg_where(id_range)
+        self._pg_cur.execute(
+            PG_ROW_HASHES_SQL.format(
+                row=_pg_row_expression(table), schema=DEFAULT_SCHEMA, table=table, where=where
+            ),
+            params,
+        )
+        target = dict(self._pg_cur.fetchall())
+        report.missing.extend(sorted(source.keys() - target.keys()))
+        report.extra.extend(sorted(target.keys() - source.keys()))
+        report.changed.extend(
+            sorted(key for key in source.keys() & target.keys() if source[key] != target[key])
+        )
+
+
+def _columns(table: str) -> list[tuple[str, str]]:
+    """Columns of the table with the kind of value they hold, id first"""
+    columns = []
+    for dto_field in dataclass_fields(DTO_TABLES_MAPPING[table]):
+        types = getattr(dto_field.type, "__args__", (dto_field.type,))
+        if datetime in types:
+            kind = "timestamp"
+        elif date in types:
+            kind = "date"
+        elif float in types:
+            kind = "float"
+        else:
+            kind = "text"
+        columns.append((dto_field.name, kind))
+    return sorted(columns, key=lambda column: column[0] != "id")
+
+
+def _sqlite_column(name: str) -> str:
+    renamed = {pg: sqlite for sqlite, pg in RENAMED_COLUMNS.items()}
+    return renamed.get(name, name)
+
+
+def _pg_row_expression(table: str) -> str:
+    """Canonical row text built by Postgres, the same as _canonical builds"""
+    expressions = {
+        "timestamp": "round(extract(epoch FROM {name}) * 1000000)::bigint::text",
+        "date": "to_char({name}, 'YYYY-MM-DD')",
+        "float": "{name}::float8::text",
+        "text": "{name}::text",
+    }
+    values = [
+        f"coalesce({expressions[kind].format(name=name)}, E'\\\\N')"
+        for name, kind in _columns(table)
+    ]
+    return f"concat_ws(E'\\x1f', {', '.join(values)})"
+
+
+def _canonical(value: Any, kind: str) -> str:
+    if value is None:
+        return NULL
+    if kind == "timestamp":
+        moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return str((moment - EPOCH) // timedelta(microseconds=1))
+    if kind == "float":
+        text = repr(float(value))
+        # Postgres prints whole floats without the fraction
+        return text[:-2] if text.endswith(".0") else text
+    return str(value)
+
+
+def _pg_where(id_range: tuple[str | None, str | None]) -> tuple[str, list[str]]:
+    lower, upper = id_range
+    conditions, params = [], []
+    if lower is not None:
+        conditions.append("id >= %s::uuid")
+        params.append(lower)
+    if upper is not None:
+        conditions.append("id < %s::uuid")
+        params.append(upper)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=tuple(DTO_TABLES_MAPPING),
+        default=tuple(DTO_TABLES_MAPPING),
+    )
+    parser.add_argument("--ranges", type=int, default=RANGES, help="ranges per split")
+    parser.add_argument(
+        "--leaf-rows",
+        type=int,
+        default=LEAF_ROWS,
+        help="ranges of at most this many rows are compared row by row",
+    )
+    args = parser.parse_args()
+
+    with connect_to_sqlite3(SQLITE_DB_PATH, read_only=True) as sqlite_cur, connect_to_postgres(
+        PG_DSL, DictCursor
+    ) as pg_cur:
+        verifier = ChecksumVerifier(sqlite_cur, pg_cur, args.ranges, args.leaf_rows)
+        reports = [verifier.verify(table) for table in args.tables]
+
+    for report in reports:
+        print(report.summary())
+    if not all(report.ok for report in reports):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()